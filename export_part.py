@@ -1,43 +1,62 @@
 # export_part.py
 import sys
 import os
-from typing import Tuple, Optional, Dict, Any
-from moviepy.editor import VideoFileClip
-import moviepy.config as mpy_config
-from ffprobe_utils import get_ffprobe_path, run_ffprobe
-from ffmpeg_config import get_ffmpeg_path
+import argparse
+import subprocess
+from typing import Tuple, Optional, Dict, Any, List
+from ffprobe_utils import probe_streams, get_audio_stream, get_duration
+from logger_config import get_logger
+from ffmpeg_config import (
+    get_ffmpeg_path,
+    get_ffprobe_path,
+    get_preset,
+    detect_hw_encoder,
+    has_hwaccel,
+    VAAPI_DEVICE,
+    FFMPEG_QUIET_ARGS,
+    stderr_tail,
+)
 
 # Constants for configuration
 VIDEO_CODEC = "libx264"
 AUDIO_CODEC = "aac"
 AUDIO_BITRATE = "192k"
 AUDIO_FPS = 44100
-PRESET = "medium"
-THREADS = 4
+# CPUs this process may run on; honours affinity masks where supported
+CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+THREADS = CPUS
 AUDIO_CHANNELS = 2
+ACCURATE_SEEK_MARGIN = 5.0
+NVENC_PRESET = "p4"
+HW_QUALITY = 23
+# VideoToolbox quality runs from 1 to 100, higher is better
+VIDEOTOOLBOX_QUALITY = 65
+# Output path that makes ffmpeg write the segment to its stdout
+PIPE_OUTPUT = "pipe:1"
 
-# Set FFMPEG binary for stability
-mpy_config.change_settings({"FFMPEG_BINARY": get_ffmpeg_path()})
+logger = get_logger(__name__)
 
 
-def check_audio_stream(video_path: str, ffprobe_path: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+def check_audio_stream(video_path: str, ffprobe_path: str,
+                       probe: Optional[Dict[str, Any]] = None) -> Tuple[bool, Optional[Dict[str, Any]]]:
     """Check if the input video has an audio stream.
     
     Args:
         video_path: Path to the video file.
         ffprobe_path: Path to ffprobe binary.
+        probe: Existing ``probe_streams`` result for the video, to avoid probing again.
     
     Returns:
         Tuple[bool, Optional[Dict]]: (has_audio, audio_info) where audio_info has codec and sample rate.
     """
-    data = run_ffprobe(ffprobe_path, ["-show_streams", "-select_streams", "a"], video_path)
-    if not data or "streams" not in data or not data["streams"]:
-        print(f"[WARNING] No audio stream detected in {video_path}")
+    if probe is None:
+        probe = probe_streams(video_path, ffprobe_path)
+    audio_info = get_audio_stream(probe)
+    if audio_info is None:
+        logger.warning("No audio stream detected in %s", video_path)
         return False, None
-    audio_info = data["streams"][0]
-    print(f"[INFO] Audio stream detected in {video_path}: "
-          f"codec={audio_info.get('codec_name', 'unknown')}, "
-          f"sample_rate={audio_info.get('sample_rate', 'unknown')}")
+    logger.info("Audio stream detected in %s: codec=%s, sample_rate=%s", video_path,
+                audio_info.get("codec_name", "unknown"), audio_info.get("sample_rate", "unknown"))
     return True, audio_info
 
 def verify_output_audio(output_path: str, ffprobe_path: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
@@ -50,91 +69,261 @@ def verify_output_audio(output_path: str, ffprobe_path: str) -> Tuple[bool, Opti
     Returns:
         Tuple[bool, Optional[Dict]]: (has_audio, audio_info) where audio_info has codec and sample rate.
     """
-    data = run_ffprobe(ffprobe_path, ["-show_streams", "-select_streams", "a"], output_path)
-    if not data or "streams" not in data or not data["streams"]:
-        print(f"[WARNING] No audio stream detected in output {output_path}")
+    audio_info = get_audio_stream(probe_streams(output_path, ffprobe_path))
+    if audio_info is None:
+        logger.warning("No audio stream detected in output %s", output_path)
         return False, None
-    audio_info = data["streams"][0]
-    print(f"[INFO] Audio stream verified in {output_path}: "
-          f"codec={audio_info.get('codec_name', 'unknown')}, "
-          f"sample_rate={audio_info.get('sample_rate', 'unknown')}")
+    logger.info("Audio stream verified in %s: codec=%s, sample_rate=%s", output_path,
+                audio_info.get("codec_name", "unknown"), audio_info.get("sample_rate", "unknown"))
     return True, audio_info
 
+def can_copy_audio(audio_info: Optional[Dict[str, Any]]) -> bool:
+    """Check whether an audio stream can be copied instead of re-encoded.
+
+    AAC with at most ``AUDIO_CHANNELS`` channels already matches what the
+    re-encode would produce, so it is copied as-is.
+    """
+    if not audio_info or audio_info.get("codec_name") != AUDIO_CODEC:
+        return False
+    return int(audio_info.get("channels", AUDIO_CHANNELS)) <= AUDIO_CHANNELS
+
+def encoder_args(encoder: str, preset: str, threads: int = THREADS) -> Tuple[List[str], List[str]]:
+    """Get the ffmpeg arguments needed to re-encode with ``encoder``.
+
+    Hardware decode is paired with ``-hwaccel_output_format`` for NVENC and
+    VAAPI when ffmpeg supports it; otherwise frames are decoded on the CPU and
+    uploaded by the encoder. No filters are applied here, so no
+    hwdownload/hwupload is needed.
+
+    Args:
+        encoder: Name of the ffmpeg video encoder.
+        preset: libx264 preset, translated for encoders that name presets differently.
+        threads: Encoder threads for libx264.
+
+    Returns:
+        Tuple[List[str], List[str]]: (input_args, output_args) to place before
+        and after ``-i`` respectively.
+    """
+    # Keep decoded surfaces in GPU memory so frames never round-trip through RAM
+    if encoder == "h264_nvenc":
+        input_args = ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"] if has_hwaccel("cuda") else []
+        return (input_args,
+                ["-c:v", encoder, "-preset", NVENC_PRESET, "-tune", "hq",
+                 "-rc", "vbr", "-cq", str(HW_QUALITY)])
+    if encoder == "h264_videotoolbox":
+        input_args = ["-hwaccel", "videotoolbox"] if has_hwaccel("videotoolbox") else []
+        return input_args, ["-c:v", encoder, "-q:v", str(VIDEOTOOLBOX_QUALITY)]
+    if encoder == "h264_vaapi":
+        return (["-hwaccel", "vaapi", "-hwaccel_output_format", "vaapi",
+                 "-vaapi_device", VAAPI_DEVICE],
+                ["-c:v", encoder, "-qp", str(HW_QUALITY)])
+    if encoder == "h264_qsv":
+        # QSV has no ultrafast/superfast presets
+        qsv_preset = "veryfast" if preset in ("ultrafast", "superfast") else preset
+        return [], ["-c:v", encoder, "-preset", qsv_preset, "-global_quality", str(HW_QUALITY)]
+    return [], ["-c:v", encoder, "-preset", preset, "-threads", str(threads)]
+
+def build_ffmpeg_command(video_path: str, start: float, end: float, output_path: str,
+                         has_audio: bool, audio_info: Optional[Dict[str, Any]] = None,
+                         preset: Optional[str] = None,
+                         encoder: Optional[str] = None,
+                         accurate: bool = False,
+                         threads: int = THREADS,
+                         hwaccel: bool = True) -> List[str]:
+    """Build the ffmpeg command used to export a segment.
+
+    The segment is stream-copied unless ``preset`` is given, in which case it is
+    re-encoded with the fastest available H.264 encoder; audio is copied when
+    it is already AAC and re-encoded to AAC otherwise. Seeking always
+    happens on the demuxer (``-ss`` before ``-i``); with ``accurate`` it stops
+    shortly before ``start`` and a second ``-ss`` after ``-i`` decodes only the
+    remaining frames, so the cut lands on the exact frame.
+
+    Args:
+        video_path: Path to the input video.
+        start: Start time in seconds.
+        end: End time in seconds.
+        output_path: Path for the output video, or ``PIPE_OUTPUT`` for stdout.
+        has_audio: Whether the input has an audio stream.
+        audio_info: ffprobe information about the audio stream.
+        preset: libx264 preset to re-encode with, or None to stream-copy.
+        encoder: Video encoder to use when re-encoding; detected when None.
+        accurate: Cut on the exact frame. Implies re-encoding with the
+            configured preset when no preset is given.
+        threads: Encoder threads when re-encoding with libx264. Callers running
+            several exports at once should pass ``CPUS // workers``.
+        hwaccel: Allow a detected hardware encoder; False forces libx264.
+
+    Returns:
+        List[str]: The ffmpeg argument list.
+    """
+    if accurate and not preset:
+        preset = get_preset()
+
+    # Stream copies keep the source timestamps, so regenerate any missing ones
+    input_args = ["-fflags", "+genpts"]
+    output_args = ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+    if preset:
+        encoder = encoder or (detect_hw_encoder() if hwaccel else None) or VIDEO_CODEC
+        input_args, output_args = encoder_args(encoder, preset, threads)
+        if has_audio and can_copy_audio(audio_info):
+            output_args += ["-c:a", "copy"]
+        elif has_audio:
+            audio_fps = int(audio_info.get("sample_rate", AUDIO_FPS)) if audio_info else AUDIO_FPS
+            output_args += [
+                "-c:a", AUDIO_CODEC,
+                "-b:a", AUDIO_BITRATE,
+                "-ar", str(audio_fps),
+                "-ac", str(AUDIO_CHANNELS),  # Force stereo
+            ]
+
+    # -ss/-to before -i seek on the demuxer instead of decoding up to ``start``
+    if accurate:
+        fast_seek = max(start - ACCURATE_SEEK_MARGIN, 0)
+        seek_args = ["-ss", str(fast_seek), "-i", video_path,
+                     "-ss", str(start - fast_seek), "-t", str(end - start)]
+    else:
+        seek_args = ["-ss", str(start), "-to", str(end), "-i", video_path]
+
+    command = [get_ffmpeg_path(), *FFMPEG_QUIET_ARGS, "-y",
+               *input_args, *seek_args, *output_args]
+
+    if not has_audio:
+        command.append("-an")
+
+    if output_path == PIPE_OUTPUT:
+        # Pipes cannot be seeked back into, so write a fragmented MP4 instead
+        command += ["-f", "mp4", "-movflags", "empty_moov+frag_keyframe+default_base_moof"]
+    else:
+        command += ["-movflags", "+faststart"]
+    command.append(output_path)
+    return command
+
+def export_segment(video_path: str, start: float, end: float, output_path: str,
+                   has_audio: bool, duration: Optional[float] = None,
+                   audio_info: Optional[Dict[str, Any]] = None,
+                   preset: Optional[str] = None,
+                   accurate: bool = False,
+                   threads: int = THREADS,
+                   hwaccel: bool = True) -> Tuple[str, bool, Optional[str]]:
+    """Export one segment of a video with a single ffmpeg call.
+
+    Args:
+        video_path: Path to the input video.
+        start: Start time in seconds.
+        end: End time in seconds.
+        output_path: Path for the output video.
+        has_audio: Whether the input has an audio stream.
+        duration: Duration of the input in seconds, used to clamp ``end``.
+        audio_info: ffprobe information about the audio stream.
+        preset: Preset to re-encode with, or None to stream-copy.
+        accurate: Cut on the exact frame (re-encodes).
+        threads: Encoder threads when re-encoding with libx264.
+        hwaccel: Allow a detected hardware encoder; False forces libx264.
+
+    Returns:
+        Tuple[str, bool, Optional[str]]: (output_path, success, error message)
+    """
+    if duration is not None:
+        end = min(end, duration)
+
+    command = build_ffmpeg_command(video_path, start, end, output_path,
+                                   has_audio, audio_info, preset=preset,
+                                   accurate=accurate, threads=threads,
+                                   hwaccel=hwaccel)
+    # When streaming, ffmpeg inherits our stdout
+    stdout = None if output_path == PIPE_OUTPUT else subprocess.DEVNULL
+    try:
+        subprocess.run(command, stdin=subprocess.DEVNULL, stdout=stdout,
+                       stderr=subprocess.PIPE, check=True)
+        return output_path, True, None
+    except subprocess.CalledProcessError as e:
+        error_msg = stderr_tail(e.stderr, str(e))
+        return output_path, False, error_msg
+    except OSError as e:
+        return output_path, False, f"Failed to execute ffmpeg: {e}"
+
 def main():
     """Main function to trim a video segment and export it with audio."""
-    # Parse arguments
-    try:
-        video_path, start, end, output_path = sys.argv[1], float(sys.argv[2]), float(sys.argv[3]), sys.argv[4]
-    except (IndexError, ValueError) as e:
-        print(f"[ERROR] Invalid arguments: {e}")
+    parser = argparse.ArgumentParser(description="Export a single segment of a video")
+    parser.add_argument("video", help="Path to the input video file")
+    parser.add_argument("start", type=float, help="Start time in seconds")
+    parser.add_argument("end", type=float, help="End time in seconds")
+    parser.add_argument("output", nargs="?", help="Path of the exported segment")
+    parser.add_argument(
+        "--stdout",
+        action="store_true",
+        help="Write the segment to stdout as a fragmented MP4 instead of a file")
+    parser.add_argument(
+        "--preset",
+        help="Re-encode with this preset instead of stream-copying")
+    parser.add_argument(
+        "--accurate",
+        action="store_true",
+        help="Cut on the exact frame instead of the nearest keyframe (re-encodes)")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=THREADS,
+        help="Encoder threads when re-encoding (defaults to the available CPUs)")
+    parser.add_argument(
+        "--hwaccel",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Use a hardware encoder when one is available (--no-hwaccel forces libx264)")
+    parser.add_argument(
+        "--has-audio",
+        action=argparse.BooleanOptionalAction,
+        help="Whether the input has audio, if already known (skips probing)")
+    parser.add_argument(
+        "--source-duration",
+        type=float,
+        help="Duration of the input in seconds, if already known (skips probing)")
+    args = parser.parse_args()
+    if args.stdout == bool(args.output):
+        parser.error("give either an output path or --stdout")
+
+    # Log messages go to stderr, so with --stdout only ffmpeg writes to stdout
+    output_path = PIPE_OUTPUT if args.stdout else args.output
+    export_main(args.video, args.start, args.end, output_path, args)
+
+def export_main(video_path: str, start: float, end: float, output_path: str,
+                args: argparse.Namespace) -> None:
+    """Export one segment as requested on the command line."""
+    if not os.path.isfile(video_path):
+        logger.error("Video file not found: %s", video_path)
+        sys.exit(1)
+    if end <= start:
+        logger.error("Invalid time range: %ss to %ss", start, end)
         sys.exit(1)
 
-    # Generate unique temp audio file name
-    base_name = os.path.splitext(os.path.basename(output_path))[0]
-    temp_audio_file = f"temp-audio-{base_name}.m4a"
+    logger.info("Trimming %s from %ss to %ss into %s", video_path, start, end, output_path)
 
-    print(f"[INFO] Trimming {video_path} from {start}s to {end}s into {output_path}")
-    
     # Locate ffprobe once
     ffprobe_path = get_ffprobe_path()
-    has_audio = False
 
-    try:
-        # Check for audio stream in input
-        has_audio, audio_info = check_audio_stream(video_path, ffprobe_path)
-
-        # Load and trim the video
-        with VideoFileClip(video_path).subclip(start, end) as clip:
-            # Adjust audio settings based on input
-            audio_codec = AUDIO_CODEC if has_audio else None
-            audio_bitrate = AUDIO_BITRATE if has_audio else None
-            audio_fps = int(audio_info.get("sample_rate", AUDIO_FPS)) if has_audio and audio_info else AUDIO_FPS
-
-            # Write the output video
-            clip.write_videofile(
-                output_path,
-                codec=VIDEO_CODEC,
-                audio=has_audio,
-                audio_codec=audio_codec,
-                temp_audiofile=temp_audio_file if has_audio else None,
-                remove_temp=False,  # Keep for debugging
-                verbose=False,
-                audio_bitrate=audio_bitrate,
-                audio_fps=audio_fps,
-                preset=PRESET,
-                threads=THREADS,
-                ffmpeg_params=["-ac", str(AUDIO_CHANNELS)]  # Force stereo
-            )
-
-        # Verify audio in output
-        if has_audio:
-            output_has_audio, output_audio_info = verify_output_audio(output_path, ffprobe_path)
-            if not output_has_audio:
-                print(f"[WARNING] Audio export failed for {output_path}")
-
-        # Clean up temp file
-        if has_audio and os.path.exists(temp_audio_file):
-            try:
-                os.remove(temp_audio_file)
-                print(f"[INFO] Cleaned up temporary audio file: {temp_audio_file}")
-            except OSError as e:
-                print(f"[WARNING] Failed to remove temp audio file {temp_audio_file}: {e}")
-                
-    except FileNotFoundError as e:
-        print(f"[ERROR] Video file not found: {e}")
-        sys.exit(1)
-    except ValueError as e:
-        print(f"[ERROR] Invalid time range or video data: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"[ERROR] Error trimming video: {e}")
-        if has_audio and os.path.exists(temp_audio_file):
-            try:
-                os.remove(temp_audio_file)
-                print(f"[INFO] Cleaned up temporary audio file on error: {temp_audio_file}")
-            except OSError as e:
-                print(f"[WARNING] Failed to remove temp audio file on error {temp_audio_file}: {e}")
+    # Probe the input once, and only for what the caller did not pass in
+    has_audio, audio_info, duration = args.has_audio, None, args.source_duration
+    if has_audio is None or duration is None:
+        probe = probe_streams(video_path, ffprobe_path)
+        if has_audio is None:
+            has_audio, audio_info = check_audio_stream(video_path, ffprobe_path, probe)
+        if duration is None and probe:
+            duration = get_duration(video_path, ffprobe_path, probe)
+
+    _, success, error = export_segment(video_path, start, end, output_path, has_audio,
+                                       duration, audio_info, preset=args.preset,
+                                       accurate=args.accurate, threads=args.threads,
+                                       hwaccel=args.hwaccel)
+    if not success:
+        logger.error("Error trimming video: %s", error)
         sys.exit(1)
 
+    # Verify audio in output
+    if has_audio and output_path != PIPE_OUTPUT:
+        output_has_audio, output_audio_info = verify_output_audio(output_path, ffprobe_path)
+        if not output_has_audio:
+            logger.warning("Audio export failed for %s", output_path)
+
 if __name__ == "__main__":
     main()
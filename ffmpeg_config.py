@@ -1,15 +1,52 @@
 import os
 import warnings
+import functools
+import shutil
+import subprocess
+from typing import Final, Optional
 import imageio_ffmpeg
-import moviepy.config as mpy_config
+from logger_config import get_logger
 
-_ffmpeg_dir = os.path.dirname(imageio_ffmpeg.get_ffmpeg_exe())
+logger = get_logger(__name__)
+
+# Resolved once at import; imageio-ffmpeg probes the filesystem on every call
+FFMPEG_BINARY: Final[str] = imageio_ffmpeg.get_ffmpeg_exe()
+_ffmpeg_dir = os.path.dirname(FFMPEG_BINARY)
+# Binary paths derived from _ffmpeg_dir, refreshed by _apply_ffmpeg_dir()
+_ffmpeg_bin = ""
+_ffprobe_bin = ""
+
+# libx264 presets; "faster" is far quicker than "medium" with no visible loss
+# once Instagram re-encodes the upload
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast",
+                "medium", "slow", "slower", "veryslow")
+_preset = "faster"
+
+# Keep ffmpeg's stderr down to actual errors so it is cheap to capture
+FFMPEG_QUIET_ARGS = ["-hide_banner", "-nostats", "-loglevel", "error"]
+# Only the end of ffmpeg's stderr is kept for error messages
+STDERR_TAIL_BYTES = 4096
+# Buffer for pipes carrying video bytes: 1 MB reads move whole frames or
+# fragments per syscall and stay well within the page cache
+PIPE_BUFSIZE = 1 << 20
+
+
+def stderr_tail(stderr: Optional[bytes], fallback: str = "") -> str:
+    """Decode the last ``STDERR_TAIL_BYTES`` of captured ffmpeg stderr for an error message."""
+    if not stderr:
+        return fallback
+    return stderr[-STDERR_TAIL_BYTES:].decode(errors="replace").strip() or fallback
 
 
 def _apply_ffmpeg_dir() -> None:
-    """Update moviepy and PATH to use the current ffmpeg directory."""
-    ffmpeg_bin = os.path.join(_ffmpeg_dir, "ffmpeg")
-    mpy_config.change_settings({"FFMPEG_BINARY": ffmpeg_bin})
+    """Point the binary paths and PATH at the current ffmpeg directory."""
+    global _ffmpeg_bin, _ffprobe_bin
+    # The bundled binary is not named plain "ffmpeg", so keep its real path
+    if _ffmpeg_dir == os.path.dirname(FFMPEG_BINARY):
+        _ffmpeg_bin = FFMPEG_BINARY
+    else:
+        _ffmpeg_bin = os.path.join(_ffmpeg_dir, "ffmpeg")
+    _ffprobe_bin = os.path.join(_ffmpeg_dir, "ffprobe")
     if _ffmpeg_dir not in os.environ.get("PATH", ""):
         os.environ["PATH"] = _ffmpeg_dir + os.pathsep + os.environ.get("PATH", "")
 
@@ -51,5 +88,119 @@ def get_ffmpeg_dir() -> str:
 
 def get_ffmpeg_path() -> str:
     """Get the full path to the ffmpeg executable."""
-    return os.path.join(_ffmpeg_dir, "ffmpeg")
-
+    return _ffmpeg_bin
+
+
+@functools.lru_cache(maxsize=1)
+def _find_ffprobe(ffprobe_bin: str) -> Optional[str]:
+    """Look for ffprobe at ``ffprobe_bin``, then on the system PATH.
+
+    Cached per candidate path, so the lookup only runs again after the ffmpeg
+    directory changes.
+    """
+    try:
+        if os.path.exists(ffprobe_bin):
+            logger.info("ffprobe found at %s", ffprobe_bin)
+            return ffprobe_bin
+        ffprobe_path = shutil.which("ffprobe")
+        if ffprobe_path:
+            logger.info("ffprobe found in PATH at %s", ffprobe_path)
+            return ffprobe_path
+        logger.error("ffprobe not found in FFMPEG directory or system PATH")
+        return None
+    except OSError as e:
+        logger.error("Failed to locate ffprobe: %s", e)
+        return None
+
+
+def get_ffprobe_path() -> Optional[str]:
+    """Locate the ffprobe binary in FFMPEG directory or system PATH.
+
+    The lookup runs once and is repeated only after the ffmpeg directory changes.
+
+    Returns:
+        Optional[str]: Path to ffprobe if found, None otherwise.
+    """
+    return _find_ffprobe(_ffprobe_bin)
+
+
+def set_preset(preset: str) -> None:
+    """Set the libx264 preset used whenever a segment has to be re-encoded."""
+    global _preset
+    if preset not in X264_PRESETS:
+        raise ValueError(f"Unknown preset '{preset}', expected one of {', '.join(X264_PRESETS)}")
+    _preset = preset
+
+
+def get_preset() -> str:
+    """Get the libx264 preset used for re-encoding."""
+    return _preset
+
+
+
+# Hardware H.264 encoders in order of preference
+HW_ENCODERS = ("h264_nvenc", "h264_videotoolbox", "h264_qsv", "h264_vaapi")
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+
+def _encoder_works(ffmpeg_bin: str, encoder: str) -> bool:
+    """Encode a few blank frames to check the encoder has usable hardware."""
+    command = [ffmpeg_bin, "-hide_banner", "-loglevel", "error"]
+    if encoder == "h264_vaapi":
+        command += ["-vaapi_device", VAAPI_DEVICE]
+    command += ["-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1"]
+    if encoder == "h264_vaapi":
+        command += ["-vf", "format=nv12,hwupload"]
+    command += ["-c:v", encoder, "-f", "null", "-"]
+    try:
+        subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True, timeout=10)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_hw_encoder(ffmpeg_bin: str) -> Optional[str]:
+    """Find the first usable hardware encoder for the given ffmpeg binary."""
+    try:
+        result = subprocess.run([ffmpeg_bin, "-hide_banner", "-encoders"],
+                                stdin=subprocess.DEVNULL, capture_output=True,
+                                text=True, check=True)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    listed = {fields[1] for fields in (line.split() for line in result.stdout.splitlines())
+              if len(fields) > 1}
+    for encoder in HW_ENCODERS:
+        if encoder in listed and _encoder_works(ffmpeg_bin, encoder):
+            return encoder
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_hwaccels(ffmpeg_bin: str) -> frozenset:
+    """List the hardware decoding methods the given ffmpeg binary was built with."""
+    try:
+        result = subprocess.run([ffmpeg_bin, "-hide_banner", "-hwaccels"],
+                                stdin=subprocess.DEVNULL, capture_output=True,
+                                text=True, check=True)
+    except (subprocess.CalledProcessError, OSError):
+        return frozenset()
+    # The first line is the "Hardware acceleration methods:" header
+    return frozenset(line.strip() for line in result.stdout.splitlines()[1:] if line.strip())
+
+
+def has_hwaccel(method: str) -> bool:
+    """Check whether ffmpeg supports hardware decoding with ``method`` (e.g. "cuda").
+
+    The list is cached per ffmpeg binary, so ffmpeg is only queried once.
+    """
+    return method in _probe_hwaccels(get_ffmpeg_path())
+
+
+def detect_hw_encoder() -> Optional[str]:
+    """Get the fastest usable hardware H.264 encoder, or None if there is none.
+
+    The result is cached per ffmpeg binary, so ffmpeg is only queried once.
+    """
+    return _probe_hw_encoder(get_ffmpeg_path())
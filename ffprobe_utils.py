@@ -1,59 +1,131 @@
-import os
 import json
 import subprocess
-import shutil
-from typing import Optional, Dict, Any
-from ffmpeg_config import get_ffmpeg_path
+import tempfile
+from typing import Optional, Dict, Any, List, Union, Iterator
+from logger_config import get_logger
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # orjson is optional; the stdlib parser also accepts bytes
+    _json_loads = json.loads
 
+logger = get_logger(__name__)
 
-def get_ffprobe_path() -> Optional[str]:
-    """Locate the ffprobe binary in FFMPEG directory or system PATH.
-
-    Returns:
-        Optional[str]: Path to ffprobe if found, None otherwise.
-    """
-    try:
-        ffmpeg_path = get_ffmpeg_path()
-        ffprobe_path = os.path.join(os.path.dirname(ffmpeg_path), "ffprobe")
-        if os.path.exists(ffprobe_path):
-            print(f"[INFO] ffprobe found at {ffprobe_path}")
-            return ffprobe_path
-        ffprobe_path = shutil.which("ffprobe")
-        if ffprobe_path:
-            print(f"[INFO] ffprobe found in PATH at {ffprobe_path}")
-            return ffprobe_path
-        print("[ERROR] ffprobe not found in FFMPEG directory or system PATH")
-        return None
-    except OSError as e:
-        print(f"[ERROR] Failed to locate ffprobe: {e}")
-        return None
+# Stream analysis only needs the codec parameters and the moov atom, so cap it;
+# packet listings still read the whole file regardless of these limits
+FFPROBE_INPUT_ARGS = ["-threads", "0", "-probesize", "5000000", "-analyzeduration", "5000000"]
 
 
-def run_ffprobe(ffprobe_path: str, args: list[str], video_path: str) -> Optional[Dict[str, Any]]:
-    """Run ffprobe with given arguments and parse JSON output.
+def run_ffprobe(ffprobe_path: str, args: list[str], video_path: str,
+                fmt: str = "json") -> Optional[Union[Dict[str, Any], List[str]]]:
+    """Run ffprobe with given arguments and parse its output.
 
     Args:
         ffprobe_path: Path to ffprobe binary.
         args: List of ffprobe command arguments.
         video_path: Path to the video file.
+        fmt: "json" to parse the output as JSON, or "csv" to get one
+            comma-separated line per entry without section names, which is
+            much cheaper for long packet lists.
 
     Returns:
-        Optional[Dict[str, Any]]: Parsed JSON output or None if failed.
+        Optional[Union[Dict[str, Any], List[str]]]: Parsed JSON output, or the
+        output lines for "csv", or None if failed.
     """
     if not ffprobe_path:
-        print("[ERROR] Cannot run ffprobe: binary not available")
+        logger.error("Cannot run ffprobe: binary not available")
         return None
     try:
-        cmd = [ffprobe_path, "-loglevel", "error"] + args + ["-of", "json", video_path]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return json.loads(result.stdout)
+        output_format = "csv=p=0" if fmt == "csv" else "json"
+        cmd = [ffprobe_path, "-loglevel", "error"] + FFPROBE_INPUT_ARGS + args + ["-of", output_format, video_path]
+        result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, check=True)
+        if fmt == "csv":
+            return result.stdout.decode().splitlines()
+        return _json_loads(result.stdout)
     except subprocess.CalledProcessError as e:
-        print(f"[ERROR] ffprobe command failed: {e}")
+        logger.error("ffprobe command failed: %s", e)
         return None
     except json.JSONDecodeError as e:
-        print(f"[ERROR] Failed to parse ffprobe output: {e}")
+        logger.error("Failed to parse ffprobe output: %s", e)
         return None
     except OSError as e:
-        print(f"[ERROR] Failed to execute ffprobe: {e}")
+        logger.error("Failed to execute ffprobe: %s", e)
+        return None
+
+
+def iter_ffprobe_csv(ffprobe_path: str, args: list[str], video_path: str) -> Iterator[str]:
+    """Run ffprobe with csv output and yield its lines while it is still running.
+
+    Unlike ``run_ffprobe(..., fmt="csv")`` the output is never held in memory
+    as a whole, so long packet listings are parsed as ffprobe emits them.
+    Failures are logged and simply end the iteration.
+
+    Args:
+        ffprobe_path: Path to ffprobe binary.
+        args: List of ffprobe command arguments.
+        video_path: Path to the video file.
+
+    Yields:
+        str: One output line, without the trailing newline.
+    """
+    if not ffprobe_path:
+        logger.error("Cannot run ffprobe: binary not available")
+        return
+    cmd = [ffprobe_path, "-loglevel", "error"] + FFPROBE_INPUT_ARGS + args + ["-of", "csv=p=0", video_path]
+    # stderr goes to a file so a chatty ffprobe cannot block on a full pipe
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=stderr, text=True)
+        except OSError as e:
+            logger.error("Failed to execute ffprobe: %s", e)
+            return
+        with proc:
+            for line in proc.stdout:
+                yield line.rstrip("\n")
+        if proc.returncode != 0:
+            stderr.seek(0)
+            logger.error("ffprobe command failed with exit code %s: %s", proc.returncode,
+                         stderr.read().decode(errors="replace").strip())
+
+
+def probe_streams(video_path: str, ffprobe_path: str) -> Optional[Dict[str, Any]]:
+    """Probe all streams and the container format of a video in one ffprobe call.
+
+    Args:
+        video_path: Path to the video file.
+        ffprobe_path: Path to ffprobe binary.
+
+    Returns:
+        Optional[Dict[str, Any]]: ffprobe output with "streams" and "format", or None if failed.
+    """
+    return run_ffprobe(ffprobe_path, ["-show_streams", "-show_format"], video_path)
+
+
+def get_duration(video_path: str, ffprobe_path: str,
+                 probe: Optional[Dict[str, Any]] = None) -> Optional[float]:
+    """Get the container duration of a video in seconds.
+
+    Args:
+        video_path: Path to the video file.
+        ffprobe_path: Path to ffprobe binary.
+        probe: Existing ``probe_streams`` result for the video, to avoid probing again.
+
+    Returns:
+        Optional[float]: Duration in seconds, or None if unknown.
+    """
+    if probe is None:
+        probe = run_ffprobe(ffprobe_path, ["-show_entries", "format=duration"], video_path)
+    duration = (probe or {}).get("format", {}).get("duration")
+    if duration in (None, "N/A"):
+        return None
+    return float(duration)
+
+
+def get_audio_stream(probe: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Get the first audio stream from a ``probe_streams`` result, if any."""
+    if not probe:
         return None
+    return next((stream for stream in probe.get("streams", [])
+                 if stream.get("codec_type") == "audio"), None)
@@ -0,0 +1,381 @@
+# fmp4_utils.py
+import os
+import struct
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# tfhd flag for an absolute base offset, which makes fragments position dependent
+_TFHD_BASE_DATA_OFFSET = 0x000001
+_COPY_CHUNK = 1024 * 1024
+# ftyp major brands of plain MP4 files; QuickTime ("qt  ") and 3GPP share
+# ffprobe's "mov,mp4,m4a,3gp,3g2,mj2" format name but are not MP4
+MP4_BRANDS = frozenset({b"isom", b"iso2", b"iso3", b"iso4", b"iso5", b"iso6",
+                        b"mp41", b"mp42", b"avc1", b"M4V ", b"dash"})
+
+
+class Fragment(NamedTuple):
+    """A video ``moof`` box and the data following it, up to the next video ``moof``."""
+    time: float
+    offset: int
+    length: int
+    # (offset, size) of every moof in the range, audio-only ones included
+    moofs: Tuple[Tuple[int, int], ...]
+
+
+class FragmentLayout(NamedTuple):
+    """Byte layout of a fragmented MP4: the ``ftyp+moov`` header and its fragments."""
+    init_offset: int
+    init_length: int
+    fragments: List[Fragment]
+    timescales: Dict[int, int]  # track_ID -> media timescale
+    start_time: float           # decode time of the first fragment in seconds
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, payload start, box end) for the boxes in ``data[start:end]``."""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _iter_file_boxes(f: BinaryIO, file_size: int) -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, offset, size) for the top-level boxes of a file without reading payloads."""
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        size, box_type = struct.unpack_from(">I4s", header)
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+        elif size == 0:
+            size = file_size - pos
+        if size < 8 or pos + size > file_size:
+            return
+        yield box_type, pos, size
+        pos += size
+
+
+def _find_box(data: bytes, start: int, end: int, box_type: bytes) -> Optional[Tuple[int, int]]:
+    return next(((payload, box_end) for kind, payload, box_end in _iter_boxes(data, start, end)
+                 if kind == box_type), None)
+
+
+def _payload(box: bytes) -> Tuple[int, int]:
+    """Get the (start, end) of a box's payload, whatever its header size."""
+    _, start, end = next(_iter_boxes(box))
+    return start, end
+
+
+def _tracks(moov: bytes) -> List[Tuple[int, int, bytes]]:
+    """Get (track_ID, timescale, handler type) of every track in a ``moov`` box."""
+    tracks = []
+    for kind, payload, end in _iter_boxes(moov, *_payload(moov)):
+        if kind != b"trak":
+            continue
+        tkhd = _find_box(moov, payload, end, b"tkhd")
+        mdia = _find_box(moov, payload, end, b"mdia")
+        if not tkhd or not mdia:
+            continue
+        hdlr = _find_box(moov, mdia[0], mdia[1], b"hdlr")
+        mdhd = _find_box(moov, mdia[0], mdia[1], b"mdhd")
+        if not hdlr or not mdhd:
+            continue
+        # Versioned boxes use 64-bit creation/modification times in version 1
+        track_id_at = tkhd[0] + (20 if moov[tkhd[0]] == 1 else 12)
+        timescale_at = mdhd[0] + (20 if moov[mdhd[0]] == 1 else 12)
+        track_id = struct.unpack_from(">I", moov, track_id_at)[0]
+        timescale = struct.unpack_from(">I", moov, timescale_at)[0]
+        if timescale:
+            tracks.append((track_id, timescale, bytes(moov[hdlr[0] + 8:hdlr[0] + 12])))
+    return tracks
+
+
+def _video_track(moov: bytes) -> Optional[Tuple[int, int]]:
+    """Get (track_ID, timescale) of the first video track in a ``moov`` box."""
+    return next(((track_id, timescale) for track_id, timescale, handler in _tracks(moov)
+                 if handler == b"vide"), None)
+
+
+def _set_time(buf: bytearray, at: int, version: int, value: int) -> None:
+    """Store a duration or decode time, 64-bit in version 1 boxes and 32-bit otherwise."""
+    if version == 1:
+        struct.pack_into(">Q", buf, at, value)
+    else:
+        struct.pack_into(">I", buf, at, min(value, 0xFFFFFFFF))
+
+
+def _rebase_header(header: bytes, duration: float) -> bytes:
+    """Rewrite the durations of an ``ftyp+moov`` header for a part ``duration`` seconds long.
+
+    ``mvhd``, ``mehd``, ``tkhd``, ``mdhd`` and the non-empty ``elst`` edits
+    otherwise keep describing the whole source. All fields are rewritten in
+    place, so no box changes size.
+    """
+    buf = bytearray(header)
+    moov = next(((payload, end) for kind, payload, end in _iter_boxes(buf) if kind == b"moov"), None)
+    mvhd = moov and _find_box(buf, moov[0], moov[1], b"mvhd")
+    if not mvhd:
+        return header
+    version = buf[mvhd[0]]
+    movie_timescale = struct.unpack_from(">I", buf, mvhd[0] + (20 if version == 1 else 12))[0]
+    movie_duration = round(duration * movie_timescale)
+    _set_time(buf, mvhd[0] + (24 if version == 1 else 16), version, movie_duration)
+
+    mvex = _find_box(buf, moov[0], moov[1], b"mvex")
+    mehd = mvex and _find_box(buf, mvex[0], mvex[1], b"mehd")
+    if mehd:
+        _set_time(buf, mehd[0] + 4, buf[mehd[0]], movie_duration)
+
+    for kind, payload, end in _iter_boxes(buf, *moov):
+        if kind != b"trak":
+            continue
+        tkhd = _find_box(buf, payload, end, b"tkhd")
+        if tkhd:
+            version = buf[tkhd[0]]
+            _set_time(buf, tkhd[0] + (28 if version == 1 else 20), version, movie_duration)
+        mdia = _find_box(buf, payload, end, b"mdia")
+        mdhd = mdia and _find_box(buf, mdia[0], mdia[1], b"mdhd")
+        if mdhd:
+            version = buf[mdhd[0]]
+            timescale = struct.unpack_from(">I", buf, mdhd[0] + (20 if version == 1 else 12))[0]
+            _set_time(buf, mdhd[0] + (24 if version == 1 else 16), version, round(duration * timescale))
+        edts = _find_box(buf, payload, end, b"edts")
+        elst = edts and _find_box(buf, edts[0], edts[1], b"elst")
+        if elst:
+            version = buf[elst[0]]
+            # (segment_duration, media_time, media_rate) entries
+            entry_format = ">Qqi" if version == 1 else ">Iii"
+            entry_size = struct.calcsize(entry_format)
+            count = struct.unpack_from(">I", buf, elst[0] + 4)[0]
+            # Empty edits (media_time -1) delay the track; the others play the media
+            delay = 0
+            for entry in range(elst[0] + 8, elst[0] + 8 + count * entry_size, entry_size):
+                segment_duration, media_time, _ = struct.unpack_from(entry_format, buf, entry)
+                if media_time == -1:
+                    delay += segment_duration
+                else:
+                    _set_time(buf, entry, version, max(movie_duration - delay, 0))
+    return bytes(buf)
+
+
+def _rebase_moof(moof: bytes, origin: float, timescales: Dict[int, int]) -> bytes:
+    """Shift every ``tfdt`` in a ``moof`` box so that ``origin`` seconds becomes time zero."""
+    buf = bytearray(moof)
+    for kind, payload, end in _iter_boxes(buf, *_payload(buf)):
+        if kind != b"traf":
+            continue
+        tfhd = _find_box(buf, payload, end, b"tfhd")
+        tfdt = _find_box(buf, payload, end, b"tfdt")
+        if not tfhd or not tfdt:
+            continue
+        timescale = timescales.get(struct.unpack_from(">I", buf, tfhd[0] + 4)[0])
+        if not timescale:
+            continue
+        version = buf[tfdt[0]]
+        decode_time = struct.unpack_from(">Q" if version == 1 else ">I", buf, tfdt[0] + 4)[0]
+        _set_time(buf, tfdt[0] + 4, version, max(decode_time - round(origin * timescale), 0))
+    return bytes(buf)
+
+
+def _fragment_decode_time(moof: bytes, track_id: int) -> Optional[int]:
+    """Get the video track's ``tfdt`` time in a ``moof`` box.
+
+    Returns None when the fragment has no video run, and -1 when its data is
+    addressed by absolute file offsets and therefore cannot be moved.
+    """
+    for kind, payload, end in _iter_boxes(moof, *_payload(moof)):
+        if kind != b"traf":
+            continue
+        tfhd = _find_box(moof, payload, end, b"tfhd")
+        if not tfhd:
+            continue
+        flags = struct.unpack_from(">I", moof, tfhd[0])[0] & 0xFFFFFF
+        if flags & _TFHD_BASE_DATA_OFFSET:
+            return -1
+        if struct.unpack_from(">I", moof, tfhd[0] + 4)[0] != track_id:
+            continue
+        tfdt = _find_box(moof, payload, end, b"tfdt")
+        if not tfdt:
+            return -1
+        if moof[tfdt[0]] == 1:
+            return struct.unpack_from(">Q", moof, tfdt[0] + 4)[0]
+        return struct.unpack_from(">I", moof, tfdt[0] + 4)[0]
+    return None
+
+
+def is_faststart_mp4(video_path: str) -> bool:
+    """Check that a file is an MP4 by brand with its ``moov`` ahead of any ``mdat``.
+
+    Such a file can be used as a part unchanged; anything else needs a remux.
+    Only the top-level box headers and the ``ftyp`` brand are read.
+    """
+    try:
+        file_size = os.path.getsize(video_path)
+        with open(video_path, "rb") as f:
+            boxes = list(_iter_file_boxes(f, file_size))
+            if not boxes or boxes[0][0] != b"ftyp" or boxes[0][2] < 12:
+                return False
+            f.seek(boxes[0][1] + 8)
+            if f.read(4) not in MP4_BRANDS:
+                return False
+    except (OSError, struct.error) as e:
+        logger.warning("Could not read the MP4 boxes of %s: %s", video_path, e)
+        return False
+    types = [kind for kind, _, _ in boxes]
+    return b"moov" in types and (b"mdat" not in types or types.index(b"moov") < types.index(b"mdat"))
+
+
+def read_fragment_layout(video_path: str) -> Optional[FragmentLayout]:
+    """Map a fragmented MP4 into its init header and independently copyable fragments.
+
+    Only top-level box headers plus the small ``moov``/``moof`` boxes are
+    read. Files that are not purely fragmented (samples in a leading ``mdat``,
+    absolute data offsets, no video track) return None.
+
+    Args:
+        video_path: Path to the video file.
+
+    Returns:
+        Optional[FragmentLayout]: The layout, with fragment times in seconds
+        relative to the first fragment, or None if the file cannot be sliced.
+    """
+    try:
+        file_size = os.path.getsize(video_path)
+        with open(video_path, "rb") as f:
+            boxes = list(_iter_file_boxes(f, file_size))
+            types = [kind for kind, _, _ in boxes]
+            if not types or types[0] != b"ftyp" or b"moof" not in types or b"moov" not in types:
+                return None
+            moov_index = types.index(b"moov")
+            first_moof = types.index(b"moof")
+            # Samples in an mdat before the fragments are addressed from the moov
+            if moov_index > first_moof or b"mdat" in types[:first_moof]:
+                return None
+            _, moov_offset, moov_size = boxes[moov_index]
+            f.seek(moov_offset)
+            moov = f.read(moov_size)
+            tracks = _tracks(moov)
+            track = _video_track(moov)
+            if track is None:
+                return None
+            track_id, timescale = track
+
+            fragments = []
+            first_time = None
+            current = None
+            for kind, offset, size in boxes[moov_index + 1:]:
+                if kind == b"moof":
+                    f.seek(offset)
+                    decode_time = _fragment_decode_time(f.read(size), track_id)
+                    if decode_time == -1:
+                        return None
+                    if decode_time is None:
+                        # Audio-only fragment: it belongs to the running video fragment
+                        if current is not None:
+                            current[2] = offset + size - current[1]
+                            current[3].append((offset, size))
+                        continue
+                    if current is not None:
+                        fragments.append(Fragment(*current[:3], tuple(current[3])))
+                    time = decode_time / timescale
+                    first_time = time if first_time is None else first_time
+                    current = [time - first_time, offset, size, [(offset, size)]]
+                elif kind == b"mdat" and current is not None:
+                    current[2] = offset + size - current[1]
+            if current is not None:
+                fragments.append(Fragment(*current[:3], tuple(current[3])))
+    except (OSError, struct.error) as e:
+        logger.warning("Could not read the MP4 boxes of %s: %s", video_path, e)
+        return None
+    if not fragments:
+        return None
+    _, ftyp_offset, _ = boxes[0]
+    return FragmentLayout(ftyp_offset, moov_offset + moov_size - ftyp_offset, fragments,
+                          {track_id: timescale for track_id, timescale, _ in tracks}, first_time)
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, offset: int, length: int) -> None:
+    """Append ``length`` bytes of ``src`` from ``offset`` to ``dst``, in the kernel if possible."""
+    if hasattr(os, "copy_file_range"):
+        try:
+            while length > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), length, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                length -= copied
+        except OSError:
+            # e.g. unsupported file system or kernel; finish with plain reads
+            pass
+    src.seek(offset)
+    while length > 0:
+        chunk = src.read(min(length, _COPY_CHUNK))
+        if not chunk:
+            raise OSError("Unexpected end of file while copying fragments")
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def write_fragments(video_path: str, layout: FragmentLayout, start: float, end: float,
+                    output_path: str, duration: Optional[float] = None) -> Tuple[str, bool, Optional[str]]:
+    """Write the fragments starting in ``[start, end)`` as a standalone fragmented MP4.
+
+    The init header is copied with its durations rewritten for the part, and
+    every ``moof`` gets its ``tfdt`` shifted so the part starts at time zero.
+    Sample data (``mdat``) is copied byte for byte.
+
+    Args:
+        video_path: Path to the fragmented source.
+        layout: Result of ``read_fragment_layout`` for the source.
+        start: Start time in seconds.
+        end: End time in seconds.
+        output_path: Path for the output video.
+        duration: Duration of the source in seconds, which bounds a part that
+            ends with the last fragment.
+
+    Returns:
+        Tuple[str, bool, Optional[str]]: (output_path, success, error message)
+    """
+    indices = [i for i, frag in enumerate(layout.fragments) if start <= frag.time < end]
+    if not indices:
+        return output_path, False, f"No fragment starts between {start:.3f}s and {end:.3f}s"
+    selected = layout.fragments[indices[0]:indices[-1] + 1]
+    if indices[-1] + 1 < len(layout.fragments):
+        part_end = layout.fragments[indices[-1] + 1].time
+    else:
+        part_end = max(duration if duration is not None else 0.0, selected[-1].time)
+    origin = selected[0].time
+    temp_path = output_path + ".tmp"
+    try:
+        # Unbuffered, so kernel copies and plain writes share one file position
+        with open(video_path, "rb") as src, open(temp_path, "wb", buffering=0) as dst:
+            src.seek(layout.init_offset)
+            dst.write(_rebase_header(src.read(layout.init_length), part_end - origin))
+            for frag in selected:
+                pos = frag.offset
+                for moof_offset, moof_size in frag.moofs:
+                    _copy_range(src, dst, pos, moof_offset - pos)
+                    src.seek(moof_offset)
+                    dst.write(_rebase_moof(src.read(moof_size), layout.start_time + origin,
+                                           layout.timescales))
+                    pos = moof_offset + moof_size
+                _copy_range(src, dst, pos, frag.offset + frag.length - pos)
+        os.replace(temp_path, output_path)
+        return output_path, True, None
+    except (OSError, struct.error) as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return output_path, False, str(e)
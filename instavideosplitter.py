@@ -1,252 +1,1065 @@
-from moviepy.editor import VideoFileClip, ColorClip, concatenate_videoclips
-from moviepy.audio.AudioClip import AudioArrayClip
-import numpy as np
 import os
-import sys
+import json
+import logging
+import asyncio
+import bisect
+import functools
 import subprocess
-import shlex
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import moviepy.config as mpy_config
-from ffmpeg_config import get_ffmpeg_path
-from ffprobe_utils import get_ffprobe_path, run_ffprobe
+import shutil
+import tempfile
+import threading
+from collections import deque
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from ffmpeg_config import (
+    get_ffmpeg_path,
+    get_ffprobe_path,
+    get_preset,
+    set_preset,
+    X264_PRESETS,
+    FFMPEG_QUIET_ARGS,
+    stderr_tail,
+)
+from logger_config import get_logger
+from ffprobe_utils import iter_ffprobe_csv, probe_streams, get_audio_stream, get_duration
+from fmp4_utils import FragmentLayout, is_faststart_mp4, read_fragment_layout, write_fragments
 from export_part import (
+    export_segment,
+    build_ffmpeg_command,
     AUDIO_CODEC,
     AUDIO_BITRATE,
-    PRESET,
     THREADS,
+    CPUS,
     AUDIO_CHANNELS,
 )
-from typing import Tuple, Optional, Dict, Any, List
+from typing import Tuple, Optional, List, Dict, Callable, NamedTuple
+
+logger = get_logger(__name__)
 
 # Constants for configuration
 SEGMENT_DURATION_DEFAULT = 60
-MAX_WORKERS = 4
+# "segment_muxer" leaves keyframe alignment to ffmpeg's segment muxer, which
+# cuts at the first keyframe after each boundary, so a part can run up to one
+# GOP past segment_duration; "precise_seek" snaps each boundary to the nearest
+# keyframe in Python first and exports every part on its own, bounded by its end
+STRATEGIES = ("segment_muxer", "precise_seek")
+KEYFRAME_CACHE_SUFFIX = ".keyframes.json"
+# Black padding clips, reused across parts and runs with the same stream layout
+TAIL_CACHE_DIR = os.path.join(tempfile.gettempdir(), "instasplit-tails")
+# Upper bound for the black clip's frame rate; r_frame_rate can be a timebase like 90000/1
+MAX_TAIL_FPS = 60
+# How often running ffmpeg processes check for cancellation, in seconds
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class Segment(NamedTuple):
+    """One planned part: where it starts and ends in the input, and how much black to append."""
+    start: float
+    end: float
+    pad: float
+
+
+def _cancelled(cancel_event: Optional[threading.Event]) -> bool:
+    return cancel_event is not None and cancel_event.is_set()
+
+
+def _max_workers() -> int:
+    """Worker count for per-part exports, overridable with INSTASPLIT_WORKERS."""
+    override = os.environ.get("INSTASPLIT_WORKERS", "")
+    if override.isdigit() and int(override) > 0:
+        return int(override)
+    # Stream-copy exports are I/O bound, so run one ffmpeg per available CPU,
+    # capped so large machines do not thrash the disk
+    return max(1, min(CPUS, 16))
+
+MAX_WORKERS = _max_workers()
+
+
+def _keyframe_cache_path(video_path: str) -> str:
+    return video_path + KEYFRAME_CACHE_SUFFIX
+
+def _read_keyframe_cache(video_path: str, size: int, mtime: float) -> Optional[Tuple[float, List[float]]]:
+    """Return (duration, keyframes) from the sidecar cache if it matches the file's size and mtime."""
+    try:
+        with open(_keyframe_cache_path(video_path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("size") != size or data.get("mtime") != mtime:
+        return None
+    duration = data.get("duration")
+    keyframes = data.get("keyframes")
+    if not isinstance(duration, (int, float)) or not isinstance(keyframes, list):
+        return None
+    return float(duration), keyframes
+
+def _write_keyframe_cache(video_path: str, size: int, mtime: float, duration: float,
+                          keyframes: List[float]):
+    """Atomically write the sidecar cache; failures (e.g. read-only folder) are ignored."""
+    cache_path = _keyframe_cache_path(video_path)
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"size": size, "mtime": mtime, "duration": duration, "keyframes": keyframes}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning("Could not write keyframe cache %s: %s", cache_path, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@functools.lru_cache(maxsize=128)
+def _cached_keyframes(video_path: str, size: int, mtime: float,
+                      ffprobe_path: str) -> Tuple[Optional[float], Tuple[float, ...]]:
+    cached = _read_keyframe_cache(video_path, size, mtime)
+    if cached is not None:
+        duration, keyframes = cached
+        logger.info("Loaded %s keyframes from cache for %s", len(keyframes), video_path)
+        # The sidecar is a plain file; keep the sorted order bisect relies on
+        return duration, tuple(sorted(keyframes))
+    duration, keyframes = _probe_keyframes(video_path, ffprobe_path)
+    if duration is not None and keyframes:
+        _write_keyframe_cache(video_path, size, mtime, duration, keyframes)
+    return duration, tuple(keyframes)
+
+def clear_keyframe_cache(video_path: Optional[str] = None):
+    """Drop cached keyframes.
 
-# Set FFMPEG binary for stability
-mpy_config.change_settings({"FFMPEG_BINARY": get_ffmpeg_path()})
+    Args:
+        video_path: Also delete this video's sidecar cache file when given.
+    """
+    _cached_keyframes.cache_clear()
+    if video_path:
+        cache_path = _keyframe_cache_path(video_path)
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+            logger.info("Removed keyframe cache %s", cache_path)
 
+def get_keyframes(video_path: str, ffprobe_path: str) -> Tuple[Optional[float], List[float]]:
+    """Read the duration and keyframes of the video, reusing cached results when possible.
 
-def get_keyframes(video_path: str, ffprobe_path: str) -> List[float]:
-    """Extract keyframes (I-frames) from the video using ffprobe.
+    Results are kept in memory and in a ``<video>.keyframes.json`` sidecar
+    keyed by the file's size and mtime, so repeated runs on the same file
+    skip ffprobe entirely.
     
     Args:
         video_path: Path to the video file.
         ffprobe_path: Path to ffprobe binary.
     
     Returns:
-        List[float]: List of keyframe timestamps in seconds.
+        Tuple[Optional[float], List[float]]: Container duration in seconds
+        (None if unknown) and the list of keyframe timestamps in seconds.
     """
-    data = run_ffprobe(ffprobe_path, ["-select_streams", "v:0", "-show_entries", "frame=pkt_pts_time,pts_time,pict_type"], video_path)
-    if not data or "frames" not in data:
-        print(f"[WARNING] No keyframes detected in {video_path}")
-        return []
+    st = os.stat(video_path)
+    duration, keyframes = _cached_keyframes(video_path, st.st_size, st.st_mtime, ffprobe_path)
+    return duration, list(keyframes)
+
+def _probe_keyframes(video_path: str, ffprobe_path: str) -> Tuple[Optional[float], List[float]]:
+    """Read the duration and keyframes of the video with a single ffprobe call.
+
+    Only the packet index is read: keyframe packets carry the ``K`` flag, so
+    no frame has to be decoded. Streams whose packets carry no keyframe flags
+    fall back to decoding just the keyframes with ``-skip_frame nokey``.
+
+    Args:
+        video_path: Path to the video file.
+        ffprobe_path: Path to ffprobe binary.
+
+    Returns:
+        Tuple[Optional[float], List[float]]: Duration in seconds (None if
+        unknown) and the sorted list of keyframe timestamps in seconds.
+    """
+    duration = None
     keyframes = []
-    for f in data["frames"]:
-        if f.get("pict_type") == "I":
-            time = f.get("pkt_pts_time") or f.get("pts_time")
-            if time is not None:
-                keyframes.append(float(time))
-    print(f"[INFO] Found {len(keyframes)} keyframes in {video_path}")
-    return keyframes
+    # Lines are parsed as ffprobe emits them; only keyframe lines are converted
+    for line in iter_ffprobe_csv(ffprobe_path, ["-select_streams", "v:0",
+                                                "-show_entries", "format=duration:packet=pts_time,flags"],
+                                 video_path):
+        pts_time, sep, flags = line.partition(",")
+        if flags[:1] == "K":
+            if pts_time != "N/A":
+                keyframes.append(float(pts_time))
+        elif not sep and pts_time not in ("", "N/A"):
+            # The format section is the only single-column line
+            duration = float(pts_time)
+    if not keyframes and duration is not None:
+        logger.info("No keyframe flags in the packets of %s, decoding keyframes instead", video_path)
+        keyframes = [float(line) for line in iter_ffprobe_csv(
+                         ffprobe_path, ["-skip_frame", "nokey", "-select_streams", "v:0",
+                                        "-show_entries", "frame=best_effort_timestamp_time"],
+                         video_path)
+                     if line not in ("", "N/A")]
+    if not keyframes:
+        logger.warning("No keyframes detected in %s", video_path)
+        return duration, []
+    # Packets come in decode order; sort once so callers can bisect
+    keyframes.sort()
+    logger.info("Found %s keyframes in %s", len(keyframes), video_path)
+    return duration, keyframes
 
 def adjust_to_keyframe(time: float, keyframes: List[float]) -> float:
     """Adjust a given time to the nearest keyframe.
     
     Args:
         time: Original time in seconds.
-        keyframes: List of keyframe timestamps.
+        keyframes: Sorted list of keyframe timestamps.
     
     Returns:
         float: Adjusted time aligned to the nearest keyframe.
     """
     if not keyframes:
-        print(f"[INFO] No keyframes found, using original time: {time}")
         return time
-    closest_keyframe = min(keyframes, key=lambda x: abs(x - time))
-    print(f"[INFO] Adjusted time {time} to keyframe at {closest_keyframe}")
-    return closest_keyframe
+    idx = bisect.bisect_left(keyframes, time)
+    if idx == 0:
+        return keyframes[0]
+    if idx == len(keyframes):
+        return keyframes[-1]
+    before, after = keyframes[idx - 1], keyframes[idx]
+    # Ties go to the earlier keyframe
+    return before if time - before <= after - time else after
 
-def export_part(video_path: str, start_time: float, end_time: float, output_path: str) -> Tuple[str, bool, Optional[str]]:
-    """Export a segment using ffmpeg without re-encoding when possible.
+def snap_to_keyframes(times: np.ndarray, keyframes: List[float]) -> np.ndarray:
+    """Vectorized :func:`adjust_to_keyframe` over an array of times.
 
     Args:
-        video_path: Path to the input video.
-        start_time: Start time in seconds.
-        end_time: End time in seconds.
-        output_path: Path for the output video.
+        times: Times in seconds.
+        keyframes: Sorted list of keyframe timestamps.
 
     Returns:
-        Tuple[str, bool, Optional[str]]: (output_path, success, error message)
+        np.ndarray: Each time moved to its nearest keyframe.
     """
+    times = np.asarray(times, dtype=np.float64)
+    if not keyframes:
+        return times
+    kf = np.asarray(keyframes, dtype=np.float64)
+    idx = np.searchsorted(kf, times)
+    before = kf[np.clip(idx - 1, 0, len(kf) - 1)]
+    after = kf[np.clip(idx, 0, len(kf) - 1)]
+    # Ties go to the earlier keyframe
+    return np.where(times - before <= after - times, before, after)
+
+@functools.lru_cache(maxsize=32)
+def make_black_tail(width: int, height: int, fps: str, sample_rate: Optional[int],
+                    channels: int, duration: float) -> Optional[str]:
+    """Encode (once) a black clip with silence to append to parts by stream copy.
 
-    duration = max(end_time - start_time, 0)
+    The clip is H.264/yuv420p and AAC like the parts it is joined to, and its
+    parameter sets are repeated in-band so decoders pick them up after the join.
 
+    Args:
+        width: Frame width.
+        height: Frame height.
+        fps: Frame rate as ffprobe reports it (e.g. "30000/1001").
+        sample_rate: Audio sample rate, or None for a clip without audio.
+        channels: Audio channel count.
+        duration: Clip length in seconds.
+
+    Returns:
+        Optional[str]: Path of the cached clip, or None if it could not be made.
+    """
+    name = f"black-{width}x{height}-{fps.replace('/', '_')}-{sample_rate or 'na'}-{channels}-{duration:.2f}.mp4"
+    tail_path = os.path.join(TAIL_CACHE_DIR, name)
+    if os.path.exists(tail_path):
+        return tail_path
     command = [
         get_ffmpeg_path(),
-        "-y",                 # overwrite output
-        "-ss", str(start_time),
-        "-i", video_path,
-        "-t", str(duration),
-        "-c", "copy",
-        output_path,
+        *FFMPEG_QUIET_ARGS,
+        "-y",
+        "-f", "lavfi", "-i", f"color=c=black:s={width}x{height}:r={fps}:d={duration:.2f}",
     ]
+    if sample_rate:
+        layout = "mono" if channels == 1 else "stereo"
+        command += ["-f", "lavfi", "-i", f"anullsrc=r={sample_rate}:cl={layout}",
+                    "-c:a", AUDIO_CODEC, "-b:a", AUDIO_BITRATE, "-shortest"]
+    command += ["-c:v", "libx264", "-preset", get_preset(), "-pix_fmt", "yuv420p",
+                "-bsf:v", "dump_extra", "-t", f"{duration:.2f}", "-f", "mp4"]
+    temp_path = None
+    try:
+        os.makedirs(TAIL_CACHE_DIR, exist_ok=True)
+        # Unique name so concurrent runs never write the same file
+        fd, temp_path = tempfile.mkstemp(suffix=".mp4", dir=TAIL_CACHE_DIR)
+        os.close(fd)
+        subprocess.run(command + [temp_path], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, check=True)
+        os.replace(temp_path, tail_path)
+        return tail_path
+    except (subprocess.CalledProcessError, OSError) as e:
+        error = stderr_tail(e.stderr, str(e)) if isinstance(e, subprocess.CalledProcessError) else str(e)
+        logger.warning("Could not create black padding clip: %s", error)
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+def _black_tail_for(video_path: str, pad_duration: float, has_audio: bool) -> Optional[str]:
+    """Get a cached black clip that can be stream-copied after ``video_path``, if any."""
+    probe = probe_streams(video_path, get_ffprobe_path())
+    streams = (probe or {}).get("streams", [])
+    video = next((st for st in streams if st.get("codec_type") == "video"), None)
+    audio = get_audio_stream(probe)
+    # Stream copy only joins streams of the same codec and layout
+    if not video or video.get("codec_name") != "h264" or video.get("pix_fmt") != "yuv420p":
+        return None
+    # avg_frame_rate is the real rate; r_frame_rate is only a fallback for streams without one
+    rate = video.get("avg_frame_rate", "0/0")
+    if rate.startswith("0"):
+        rate = video.get("r_frame_rate", "0/0")
+    try:
+        fps = min(Fraction(rate).limit_denominator(1001), MAX_TAIL_FPS)
+    except (ValueError, ZeroDivisionError):
+        return None
+    if fps <= 0:
+        return None
+    if has_audio and (not audio or audio.get("codec_name") != AUDIO_CODEC
+                      or int(audio.get("channels", 0)) not in (1, 2)):
+        return None
+    return make_black_tail(int(video["width"]), int(video["height"]),
+                           f"{fps.numerator}/{fps.denominator}",
+                           int(audio["sample_rate"]) if has_audio else None,
+                           int(audio["channels"]) if has_audio else 0,
+                           round(pad_duration, 2))
 
+def _concat_copy(video_path: str, tail_path: str) -> Tuple[bool, Optional[str]]:
+    """Append ``tail_path`` to ``video_path`` in place with the concat demuxer and no re-encode."""
+    temp_path = video_path + ".tmp"
+    list_fd, list_path = tempfile.mkstemp(suffix=".txt")
     try:
-        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
-        return output_path, True, None
+        with os.fdopen(list_fd, "w", encoding="utf-8") as f:
+            for path in (video_path, tail_path):
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        command = [
+            get_ffmpeg_path(),
+            *FFMPEG_QUIET_ARGS,
+            "-y",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy",
+            "-movflags", "+faststart",
+            "-f", "mp4", temp_path,
+        ]
+        subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, check=True)
+        os.replace(temp_path, video_path)
+        return True, None
     except subprocess.CalledProcessError as e:
-        error_msg = e.stderr.decode() if e.stderr else str(e)
-        return output_path, False, error_msg
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False, stderr_tail(e.stderr, str(e))
+    except OSError as e:
+        return False, str(e)
+    finally:
+        os.remove(list_path)
+
+def pad_with_black(video_path: str, pad_duration: float, has_audio: bool = True,
+                   threads: int = THREADS) -> Tuple[bool, Optional[str]]:
+    """Append black frames (and silence) to a video.
+
+    H.264/AAC parts get a cached black clip appended by stream copy, so the
+    part itself is never re-encoded. Other codecs take a single ffmpeg pass
+    where ``tpad`` extends the video and ``apad`` with ``-shortest`` extends
+    the audio to match.
+    """
+    # Less than the black clip's 10 ms resolution is nothing worth a frame
+    if round(pad_duration, 2) == 0:
+        return True, None
+    tail_path = _black_tail_for(video_path, pad_duration, has_audio)
+    if tail_path:
+        ok, err = _concat_copy(video_path, tail_path)
+        if ok:
+            return True, None
+        logger.warning("Could not append black clip to %s, re-encoding instead: %s", video_path, err)
+
+    temp_path = video_path + ".tmp"
+    command = [
+        get_ffmpeg_path(),
+        *FFMPEG_QUIET_ARGS,
+        "-y",
+        "-i", video_path,
+        "-vf", f"tpad=stop_mode=add:stop_duration={pad_duration:.6f}:color=black",
+        "-c:v", "libx264",
+        "-preset", get_preset(),
+        "-threads", str(threads),
+        "-pix_fmt", "yuv420p",
+    ]
+    if has_audio:
+        command += [
+            "-af", "apad",
+            "-shortest",
+            "-c:a", AUDIO_CODEC,
+            "-b:a", AUDIO_BITRATE,
+            "-ac", str(AUDIO_CHANNELS),
+        ]
+    else:
+        command.append("-an")
+    command += ["-movflags", "+faststart", "-f", "mp4", temp_path]
 
-def pad_with_black(video_path: str, pad_duration: float) -> Tuple[bool, Optional[str]]:
-    """Append black frames to a video using moviepy."""
     try:
-        with VideoFileClip(video_path) as clip:
-            w, h = clip.size
-            fps = clip.fps or 24
-            audio = clip.audio
-
-            black = ColorClip(size=(w, h), color=(0, 0, 0), duration=pad_duration)
-            if audio:
-                sr = int(audio.fps)
-                # Construct a silent audio clip matching the required duration
-                # and number of channels. Using ``AudioArrayClip`` avoids shape
-                # ambiguities that can arise with a lambda-based ``AudioClip``
-                # when ``t`` is provided as a scalar.
-                silence_array = np.zeros((int(pad_duration * sr), audio.nchannels))
-                silence = AudioArrayClip(silence_array, fps=sr)
-                black = black.set_audio(silence)
-
-            with concatenate_videoclips([clip, black]) as final:
-                temp_path = video_path + ".tmp"
-                final.write_videofile(
-                    temp_path,
-                    codec="libx264",
-                    audio=audio is not None,
-                    audio_codec=AUDIO_CODEC if audio else None,
-                    audio_bitrate=AUDIO_BITRATE if audio else None,
-                    audio_fps=int(audio.fps) if audio else None,
-                    verbose=False,
-                    preset=PRESET,
-                    threads=THREADS,
-                    ffmpeg_params=["-ac", str(AUDIO_CHANNELS)]
-                )
-            os.replace(temp_path, video_path)
+        subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.PIPE, check=True)
+        os.replace(temp_path, video_path)
         return True, None
-    except Exception as e:
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        error_msg = stderr_tail(e.stderr, str(e))
+        return False, error_msg
+    except OSError as e:
         return False, str(e)
 
-def export_and_pad(video_path: str, start_time: float, end_time: float, output_path: str, pad_time: float) -> Tuple[str, bool, Optional[str]]:
+def export_and_pad(video_path: str, start_time: float, end_time: float, output_path: str, pad_time: float,
+                   has_audio: bool = True, duration: Optional[float] = None,
+                   threads: int = THREADS) -> Tuple[str, bool, Optional[str]]:
     """Export a segment and optionally pad with black frames."""
-    out, success, err = export_part(video_path, start_time, end_time, output_path)
+    out, success, err = export_segment(video_path, start_time, end_time, output_path, has_audio, duration)
     if success and pad_time > 0:
-        ok, perr = pad_with_black(output_path, pad_time)
+        ok, perr = pad_with_black(output_path, pad_time, has_audio, threads)
         if not ok:
             return output_path, False, perr
     return out, success, err
 
+async def export_and_pad_async(video_path: str, start_time: float, end_time: float, output_path: str,
+                              pad_time: float, has_audio: bool = True, duration: Optional[float] = None,
+                              threads: int = THREADS,
+                              on_progress: Optional[Callable[[float], None]] = None
+                              ) -> Tuple[str, bool, Optional[str]]:
+    """Asyncio version of :func:`export_and_pad`.
+
+    If the task is cancelled, ffmpeg is killed and the partial output removed.
+
+    Args:
+        on_progress: Called with the fraction (0-1) of the part copied so far,
+            parsed from ffmpeg's ``-progress`` output.
+    """
+    if duration is not None:
+        end_time = min(end_time, duration)
+    command = build_ffmpeg_command(video_path, start_time, end_time, output_path, has_audio)
+    # Machine-readable progress on stdout, just before the output path
+    command[-1:-1] = ["-progress", "pipe:1"]
+    try:
+        proc = await asyncio.create_subprocess_exec(*command, stdin=subprocess.DEVNULL,
+                                                    stdout=subprocess.PIPE,
+                                                    stderr=subprocess.PIPE)
+    except OSError as e:
+        return output_path, False, f"Failed to execute ffmpeg: {e}"
+    async def read_tail(stream: asyncio.StreamReader) -> bytes:
+        tail = deque(maxlen=64)
+        async for line in stream:
+            tail.append(line)
+        return b"".join(tail)
+
+    # Drain stderr alongside stdout so neither pipe can fill up and block
+    # ffmpeg, keeping only its last lines for the error message
+    stderr_task = asyncio.ensure_future(read_tail(proc.stderr))
+    length = max(end_time - start_time, 1e-6)
+    try:
+        async for line in proc.stdout:
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            if on_progress and key == "out_time_us" and value.isdigit():
+                on_progress(min(int(value) / 1e6 / length, 1.0))
+        await proc.wait()
+        stderr = await stderr_task
+    except asyncio.CancelledError:
+        stderr_task.cancel()
+        proc.kill()
+        await proc.wait()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    if proc.returncode != 0:
+        return output_path, False, stderr_tail(stderr, f"ffmpeg exited with code {proc.returncode}")
+    if pad_time > 0:
+        pad = asyncio.ensure_future(asyncio.to_thread(pad_with_black, output_path, pad_time,
+                                                      has_audio, threads))
+        try:
+            ok, perr = await asyncio.shield(pad)
+        except asyncio.CancelledError:
+            # The padding thread cannot be interrupted; drop the part once it is done
+            await asyncio.gather(pad, return_exceptions=True)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        if not ok:
+            return output_path, False, perr
+    return output_path, True, None
+
+def export_whole_file(video_path: str, output_path: str, pad_time: float,
+                      has_audio: bool = True) -> Tuple[str, bool, Optional[str]]:
+    """Use the whole input, a faststart MP4, as the only part, padding it if needed.
+
+    The input is hard-linked when possible and copied otherwise; padding
+    replaces the output with a new file, so the input is never modified.
+    """
+    try:
+        try:
+            os.link(video_path, output_path)
+        except OSError:
+            # Other file system, or no hard link support
+            shutil.copy2(video_path, output_path)
+    except OSError as e:
+        return output_path, False, str(e)
+    if pad_time > 0:
+        ok, perr = pad_with_black(output_path, pad_time, has_audio)
+        if not ok:
+            os.remove(output_path)
+            return output_path, False, perr
+    return output_path, True, None
+
+def export_segments(video_path: str, starts: List[float], end_time: float,
+                    output_template: str, start_number: int,
+                    cancel_event: Optional[threading.Event] = None) -> Tuple[bool, Optional[str]]:
+    """Export consecutive segments in a single ffmpeg pass using the segment muxer.
+
+    The input is demuxed once from ``starts[0]``; the muxer itself starts each
+    new segment at the first keyframe at or after its time, so no per-segment
+    seeking is involved.
+
+    Args:
+        video_path: Path to the input video.
+        starts: Start time of each segment in seconds, strictly increasing.
+        end_time: End time of the last segment in seconds.
+        output_template: Output path containing a ``%d`` placeholder for the part number.
+        start_number: Part number of the first segment.
+        cancel_event: When set, ffmpeg is killed and the segments written so
+            far are left for the caller to discard.
+
+    Returns:
+        Tuple[bool, Optional[str]]: (success, error message)
+    """
+    first = starts[0]
+    # Input seeking resets timestamps to zero at ``first``
+    segment_times = ",".join(f"{t - first:.6f}" for t in starts[1:])
+    # Starting from the beginning needs no seek at all
+    seek_args = ["-ss", str(first)] if first > 0 else []
+
+    command = [
+        get_ffmpeg_path(),
+        *FFMPEG_QUIET_ARGS,
+        "-y",
+        "-fflags", "+genpts",
+        *seek_args,
+        "-i", video_path,
+        "-t", str(max(end_time - first, 0)),
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_times", segment_times,
+        "-segment_start_number", str(start_number),
+        "-reset_timestamps", "1",
+        # Put the moov atom first so each part can start playing while downloading
+        "-segment_format_options", "movflags=+faststart",
+        "-avoid_negative_ts", "make_zero",
+        output_template,
+    ]
+
+    # stderr goes to a file so it cannot block ffmpeg while we poll for cancellation
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=stderr)
+        while True:
+            try:
+                proc.wait(timeout=CANCEL_POLL_INTERVAL if cancel_event is not None else None)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_event.is_set():
+                    proc.kill()
+                    proc.wait()
+                    return False, "Cancelled"
+        if proc.returncode != 0:
+            stderr.seek(0)
+            return False, stderr_tail(stderr.read(), f"ffmpeg exited with code {proc.returncode}")
+    return True, None
+
+def _list_files(directory: str) -> set:
+    """Get the names of the regular files in ``directory`` with a single scandir."""
+    with os.scandir(directory) as entries:
+        return {entry.name for entry in entries if entry.is_file()}
+
+def _export_with_segment_muxer(video_path: str, plan: List[Segment],
+                               output_paths: List[str], first: int,
+                               progress_callback: Optional[callable],
+                               has_audio: bool, duration: float,
+                               cancel_event: Optional[threading.Event] = None) -> int:
+    """Export parts ``first`` onwards with one ffmpeg call, keeping existing files.
+
+    Segments are written to a staging directory next to the outputs and only
+    moved into place when the target does not exist yet. Parts the segment
+    muxer did not produce are exported again one by one. A cancelled run
+    discards the whole staging directory.
+    """
+    num_parts = len(plan)
+    output_dir = os.path.dirname(output_paths[0])
+    staging_dir = tempfile.mkdtemp(prefix=".parts-", dir=output_dir or ".")
+    try:
+        staged_paths = [os.path.join(staging_dir, os.path.basename(path)) for path in output_paths]
+        base_name = os.path.basename(output_paths[0]).rsplit("-part", 1)[0]
+        # Escape '%' so the segment muxer only expands the part number
+        template = os.path.join(staging_dir, base_name.replace("%", "%%") + "-part%d.mp4")
+
+        starts = [start for start, _, _ in plan[first:]]
+        success, error = export_segments(video_path, starts, plan[-1].end, template, first + 1,
+                                         cancel_event)
+        if _cancelled(cancel_event):
+            return 0
+        if not success:
+            logger.warning("Segment muxer failed, exporting parts one by one: %s", error)
+
+        pad_time = plan[-1].pad
+        if success and pad_time > 0 and os.path.exists(staged_paths[-1]):
+            ok, perr = pad_with_black(staged_paths[-1], pad_time, has_audio)
+            if not ok:
+                os.remove(staged_paths[-1])
+                logger.warning("Failed to pad %s, retrying it on its own: %s", output_paths[-1], perr)
+
+        # One listing per directory instead of a stat per part
+        existing = _list_files(output_dir or ".")
+        staged = _list_files(staging_dir) if success else set()
+        names = [os.path.basename(path) for path in output_paths]
+        pending = [i for i in range(first, num_parts) if names[i] not in existing]
+        retry = [i for i in pending if names[i] not in staged]
+        processed_parts = num_parts - len(pending)
+        completed_parts = 0
+        for i in pending:
+            if i in retry:
+                continue
+            os.replace(staged_paths[i], output_paths[i])
+            processed_parts += 1
+            completed_parts += 1
+            logger.info("Exported: %s", output_paths[i])
+            if progress_callback:
+                progress_callback(processed_parts, num_parts)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    if retry:
+        completed_parts += _export_individually(video_path, plan, output_paths, retry,
+                                                progress_callback, has_audio, duration,
+                                                cancel_event)
+    return completed_parts
+
+def _export_fragments(video_path: str, layout: FragmentLayout,
+                      plan: List[Segment], output_paths: List[str],
+                      pending: List[int], progress_callback: Optional[callable],
+                      has_audio: bool, duration: float,
+                      cancel_event: Optional[threading.Event] = None) -> int:
+    """Export pending parts of a fragmented MP4 by copying whole fragments.
+
+    Each part is the source's ``ftyp+moov`` header, with its durations
+    rewritten for the part, followed by the fragments starting inside it.
+    Their ``tfdt`` times are shifted to start at zero and the sample data is
+    copied byte for byte, so nothing is demuxed. Parts that cannot be built
+    this way are exported one by one instead.
+    """
+    num_parts = len(plan)
+    processed_parts = num_parts - len(pending)
+    completed_parts = 0
+    retry = []
+    for i in pending:
+        if _cancelled(cancel_event):
+            return completed_parts
+        part_start, part_end, pad_time = plan[i]
+        # The last part takes every remaining fragment
+        end = float("inf") if i == num_parts - 1 and part_end >= duration else part_end
+        output_path, success, error = write_fragments(video_path, layout, part_start, end,
+                                                      output_paths[i], duration)
+        if success and pad_time > 0:
+            success, error = pad_with_black(output_path, pad_time, has_audio)
+            if not success:
+                os.remove(output_path)
+        if not success:
+            logger.warning("Could not copy fragments for %s, exporting it on its own: %s", output_path, error)
+            retry.append(i)
+            continue
+        processed_parts += 1
+        completed_parts += 1
+        logger.info("Exported: %s", output_path)
+        if progress_callback:
+            progress_callback(processed_parts, num_parts)
+
+    if retry:
+        completed_parts += _export_individually(video_path, plan, output_paths, retry,
+                                                progress_callback, has_audio, duration,
+                                                cancel_event)
+    return completed_parts
+
+def export_with_pyav(video_path: str, plan: List[Segment],
+                     output_paths: List[str], pending: List[int],
+                     progress_callback: Optional[callable],
+                     has_audio: bool,
+                     cancel_event: Optional[threading.Event] = None) -> int:
+    """Stream-copy all pending parts in a single demux pass with PyAV.
+
+    Used when the ``PYAV=1`` environment variable is set. The input is opened
+    once in this process and its packets are copied into one output container
+    per part, cutting at the first video keyframe at or after each planned
+    start, so no ffmpeg process is started except to pad the last part.
+    Cancellation is checked whenever a part is finished.
+
+    Raises:
+        RuntimeError: If PyAV is not installed or a part cannot be written.
+    """
+    try:
+        import av
+    except ImportError as e:
+        raise RuntimeError("PYAV=1 requires PyAV (pip install av)") from e
+
+    num_parts = len(plan)
+    starts = [start for start, _, _ in plan]
+    end_time = plan[-1].end
+    pending_set = set(pending)
+    processed_parts = num_parts - len(pending)
+    completed_parts = 0
+
+    def add_stream(container, template):
+        # PyAV 14 renamed add_stream(template=...) to add_stream_from_template
+        if hasattr(container, "add_stream_from_template"):
+            return container.add_stream_from_template(template)
+        return container.add_stream(template=template)
+
+    with av.open(video_path) as src:
+        video = src.streams.video[0]
+        in_streams = [video] + list(src.streams.audio[:1])
+        # Seeks backwards to the keyframe at or before the first pending part
+        src.seek(int(starts[pending[0]] / video.time_base), stream=video)
+
+        part, out, out_streams, part_origin = -1, None, {}, 0.0
+
+        def close_part():
+            nonlocal out, completed_parts, processed_parts
+            if out is None:
+                return
+            out.close()
+            out = None
+            pad_time = plan[part].pad
+            if pad_time > 0:
+                ok, perr = pad_with_black(output_paths[part], pad_time, has_audio)
+                if not ok:
+                    raise RuntimeError(f"Failed to export {output_paths[part]}: {perr}")
+            completed_parts += 1
+            processed_parts += 1
+            logger.info("Exported: %s", output_paths[part])
+            if progress_callback:
+                progress_callback(processed_parts, num_parts)
+
+        try:
+            for packet in src.demux(in_streams):
+                if packet.pts is None or packet.dts is None:
+                    continue  # flush packets
+                t = float(packet.pts * packet.time_base)
+
+                if packet.stream is video:
+                    if float(packet.dts * packet.time_base) >= end_time + 1.0:
+                        break
+                    if packet.is_keyframe and t < end_time:
+                        # Keyframes within a millisecond of a start open that part
+                        new_part = max(bisect.bisect_right(starts, t + 1e-3) - 1, part, pending[0])
+                        if new_part != part:
+                            close_part()
+                            if _cancelled(cancel_event):
+                                return completed_parts
+                            part, part_origin = new_part, t
+                            if part in pending_set:
+                                out = av.open(output_paths[part], "w",
+                                              options={"movflags": "+faststart"})
+                                out_streams = {s.index: add_stream(out, s) for s in in_streams}
+
+                if out is None or t < part_origin or t >= end_time:
+                    continue
+                shift = int(round(part_origin / packet.time_base))
+                packet.pts -= shift
+                packet.dts -= shift
+                packet.stream = out_streams[packet.stream.index]
+                out.mux(packet)
+            close_part()
+        except Exception:
+            if out is not None:
+                out.close()
+                os.remove(output_paths[part])
+            raise
+
+    written = _list_files(os.path.dirname(output_paths[0]) or ".")
+    missing = [i for i in pending if os.path.basename(output_paths[i]) not in written]
+    if missing:
+        raise RuntimeError(f"Failed to export {output_paths[missing[0]]}: segment was not written")
+    return completed_parts
+
+def _export_individually(video_path: str, plan: List[Segment],
+                         output_paths: List[str], pending: List[int],
+                         progress_callback: Optional[callable],
+                         has_audio: bool, duration: float,
+                         cancel_event: Optional[threading.Event] = None) -> int:
+    """Export each pending part with its own ffmpeg call."""
+    return asyncio.run(_export_individually_async(video_path, plan, output_paths, pending,
+                                                  progress_callback, has_audio, duration,
+                                                  cancel_event))
+
+async def _export_individually_async(video_path: str, plan: List[Segment],
+                                     output_paths: List[str], pending: List[int],
+                                     progress_callback: Optional[callable],
+                                     has_audio: bool, duration: float,
+                                     cancel_event: Optional[threading.Event] = None) -> int:
+    """Run the per-part ffmpeg processes from one event loop, at most MAX_WORKERS at a time.
+
+    Progress is reported in fractions of a part while ffmpeg runs. On the
+    first failure, or once ``cancel_event`` is set, the remaining exports are
+    cancelled.
+    """
+    num_parts = len(plan)
+    processed_parts = num_parts - len(pending)
+    workers = min(MAX_WORKERS, len(pending))
+    # Share the CPUs with the concurrent copies when padding re-encodes the last part
+    threads = max(1, CPUS // workers)
+    semaphore = asyncio.Semaphore(workers)
+    # Fraction done of each part that is still running
+    running: Dict[int, float] = {}
+    reported = float(processed_parts)
+
+    def report():
+        nonlocal reported
+        if progress_callback:
+            # Parts finish out of order, so never let the total step back
+            reported = max(reported, processed_parts + sum(running.values()))
+            progress_callback(reported, num_parts)
+
+    def report_part(i: int, fraction: float):
+        running[i] = fraction
+        report()
+
+    async def export(i: int) -> Tuple[int, Tuple[str, bool, Optional[str]]]:
+        part_start, part_end, pad_time = plan[i]
+        async with semaphore:
+            try:
+                return i, await export_and_pad_async(video_path, part_start, part_end, output_paths[i],
+                                                     pad_time, has_audio, duration, threads,
+                                                     on_progress=lambda fraction: report_part(i, fraction))
+            except asyncio.CancelledError:
+                running.pop(i, None)
+                raise
+
+    async def watch_cancel():
+        while not cancel_event.is_set():
+            await asyncio.sleep(CANCEL_POLL_INTERVAL)
+        for task in tasks:
+            task.cancel()
+
+    tasks = [asyncio.ensure_future(export(i)) for i in pending]
+    watcher = asyncio.ensure_future(watch_cancel()) if cancel_event is not None else None
+    completed_parts = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                i, (output_path, success, error) = await next_done
+            except asyncio.CancelledError:
+                if _cancelled(cancel_event):
+                    break
+                raise
+            # Count the part as done before dropping its running fraction
+            processed_parts += 1
+            running.pop(i, None)
+            report()
+            if success:
+                completed_parts += 1
+                logger.info("Exported: %s", output_path)
+            else:
+                logger.error("Failed: %s - %s", output_path, error)
+                raise RuntimeError(f"Failed to export {output_path}: {error}")
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return completed_parts
+
+def plan_segments(video_duration: float, segment_duration: float, num_parts: int,
+                  keyframes: List[float], offset: float = 0.0,
+                  ask_allow_long_last_part: Optional[callable] = None) -> List[Segment]:
+    """Plan where each part starts and ends.
+
+    Every nominal start is snapped to its nearest keyframe at once (a no-op
+    without keyframes, as for the segment muxer, which cuts at the next
+    keyframe itself) and shifted by ``offset``. Only the last part needs
+    special handling: it is padded when short, and may run up to 10% long
+    if ``ask_allow_long_last_part`` agrees.
+
+    Args:
+        video_duration: Duration of the input in seconds.
+        segment_duration: Duration of each part in seconds.
+        num_parts: Number of parts to plan.
+        keyframes: Sorted keyframe timestamps, or an empty list.
+        offset: Shift of every start in seconds, applied after keyframe
+            alignment when ``keyframes`` are given.
+        ask_allow_long_last_part: Called with the last part's length when it
+            is slightly longer than ``segment_duration``.
+
+    Returns:
+        List[Segment]: One segment per part.
+    """
+    nominal_starts = np.arange(num_parts, dtype=np.float64) * segment_duration
+    part_starts = np.clip(snap_to_keyframes(nominal_starts, keyframes) + offset, 0, video_duration)
+    part_ends = np.minimum(part_starts + segment_duration, video_duration)
+    plan = [Segment(start, end, 0.0) for start, end in zip(part_starts.tolist(), part_ends.tolist())]
+    if not plan:
+        return plan
+
+    last = plan[-1]
+    actual_length = video_duration - last.start
+    if actual_length < segment_duration:
+        plan[-1] = last._replace(pad=segment_duration - actual_length)
+    elif (segment_duration < actual_length <= segment_duration * 1.1
+          and ask_allow_long_last_part and ask_allow_long_last_part(actual_length)):
+        plan[-1] = last._replace(end=video_duration)
+    return plan
+
 def trim_video_to_parts(video_path: str, output_dir: Optional[str] = None,
                         progress_callback: Optional[callable] = None,
                         segment_duration: int = SEGMENT_DURATION_DEFAULT,
                         offset: float = 0.0,
-                        ask_allow_long_last_part: Optional[callable] = None) -> int:
+                        ask_allow_long_last_part: Optional[callable] = None,
+                        strategy: str = "segment_muxer",
+                        cancel_event: Optional[threading.Event] = None) -> int:
     """Trim a video into parts, aligning cuts with keyframes for better quality.
 
+    All parts are cut in a single ffmpeg pass with the segment muxer. Parts are
+    exported one by one, each limited to its planned end, when the planned
+    start times are not strictly increasing, which the segment muxer cannot
+    express, when a gap between starts is longer than a part (the muxer would
+    stretch that part up to the next start), or when the segment muxer failed
+    to produce them.
+
     Args:
         video_path: Path to the input video.
         output_dir: Directory for output files; defaults to video's directory.
         progress_callback: Function to report progress.
         segment_duration: Duration of each segment in seconds.
+        strategy: "segment_muxer" (default) skips keyframe detection and lets
+            ffmpeg cut at the first keyframe after each boundary, so a part
+            can be up to one GOP longer than ``segment_duration``;
+            "precise_seek" snaps boundaries to the nearest keyframe first and
+            exports each part separately, never past ``segment_duration``.
+        cancel_event: Set from another thread to stop exporting. Running
+            ffmpeg processes are killed and their partial outputs removed;
+            finished parts are kept, so a later run resumes after them.
 
     Returns:
-        int: Number of parts successfully created.
+        int: Number of parts successfully created, up to the cancellation if any.
 
     Raises:
         RuntimeError: If exporting any part fails.
     """
     try:
-        # Load the video
-        with VideoFileClip(video_path) as video:
-            video_duration = video.duration
+        if not os.path.isfile(video_path):
+            raise FileNotFoundError(video_path)
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy '{strategy}', expected one of {', '.join(STRATEGIES)}")
+
+        # The keyframe probe also reports the duration, so no MoviePy reader is
+        # needed; the stream probe for audio runs alongside it
+        ffprobe_path = get_ffprobe_path()
+        with ThreadPoolExecutor(max_workers=2) as probe_pool:
+            keyframes_future = None
+            if strategy == "precise_seek":
+                keyframes_future = probe_pool.submit(get_keyframes, video_path, ffprobe_path)
+            streams_future = probe_pool.submit(probe_streams, video_path, ffprobe_path)
 
-            # Get base name and output directory
+            # Get base name and output directory while ffprobe runs
             base_name = os.path.splitext(os.path.basename(video_path))[0]
             if output_dir is None:
                 output_dir = os.path.dirname(video_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            # One directory listing instead of a stat per part
+            existing = _list_files(output_dir or ".")
 
-            # Calculate number of parts
-            num_parts = int(video_duration // segment_duration)
-            if video_duration % segment_duration != 0:
-                num_parts += 1
-
-            print(f"[INFO] Video duration: {video_duration:.2f} seconds")
-            print(f"[INFO] Segment duration: {segment_duration} seconds")
-            print(f"[INFO] Total parts: {num_parts}")
-
-            # Get keyframes for alignment
-            ffprobe_path = get_ffprobe_path()
-            keyframes = get_keyframes(video_path, ffprobe_path)
-
-            # Process each part
-            tasks = []
-            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-                for i in range(num_parts):
-                    part_start_nominal = i * segment_duration
-                    part_start = adjust_to_keyframe(part_start_nominal, keyframes) + offset
-                    part_start = max(0, min(part_start, video_duration))
-                    part_end = min(part_start + segment_duration, video_duration)
-
-                    if i == num_parts - 1:
-                        actual_length = video_duration - part_start
-                        if actual_length < segment_duration:
-                            pad_time = segment_duration - actual_length
-                        else:
-                            pad_time = 0
-                            if actual_length > segment_duration and actual_length <= segment_duration * 1.1:
-                                if ask_allow_long_last_part and ask_allow_long_last_part(actual_length):
-                                    part_end = video_duration
-                                else:
-                                    part_end = min(part_start + segment_duration, video_duration)
-                            else:
-                                part_end = min(part_start + segment_duration, video_duration)
-                    else:
-                        pad_time = 0
-
-                    output_filename = f"{base_name}-part{i+1}.mp4"
-                    output_path = os.path.join(output_dir, output_filename)
-
-                    if os.path.exists(output_path):
-                        print(f"[INFO] Skipping existing file: {output_filename}")
-                        continue
-
-                    tasks.append(executor.submit(export_and_pad, video_path, part_start, part_end, output_path, pad_time))
-
-                processed_parts = 0
-                completed_parts = 0
-                for future in as_completed(tasks):
-                    output_path, success, error = future.result()
-                    processed_parts += 1
-                    if success:
-                        completed_parts += 1
-                        print(f"[INFO] Exported: {output_path}")
-                    else:
-                        print(f"[ERROR] Failed: {output_path} - {error}")
-                        if progress_callback:
-                            progress_callback(processed_parts, num_parts)
-                        raise RuntimeError(f"Failed to export {output_path}: {error}")
-                    if progress_callback:
-                        progress_callback(processed_parts, num_parts)
+            probe = streams_future.result()
+            if keyframes_future is not None:
+                video_duration, keyframes = keyframes_future.result()
+            else:
+                # The segment muxer finds keyframes itself; only the duration is needed
+                keyframes = []
+                video_duration = get_duration(video_path, ffprobe_path, probe) if probe else None
+        if video_duration is None:
+            raise ValueError(f"Could not read the duration of {video_path}")
+        has_audio = probe is not None and get_audio_stream(probe) is not None
 
-            return completed_parts
+        # Calculate number of parts
+        num_parts = int(video_duration // segment_duration)
+        if video_duration % segment_duration != 0:
+            num_parts += 1
+
+        logger.info("Video duration: %.2f seconds", video_duration)
+        logger.info("Segment duration: %s seconds", segment_duration)
+        logger.info("Total parts: %s", num_parts)
+
+        plan = plan_segments(video_duration, segment_duration, num_parts, keyframes,
+                             offset, ask_allow_long_last_part)
+
+        output_names = [f"{base_name}-part{i+1}.mp4" for i in range(num_parts)]
+        output_paths = [os.path.join(output_dir, name) for name in output_names]
+        pending = [i for i, name in enumerate(output_names) if name not in existing]
+        if not pending:
+            logger.info("All parts already exist")
+            return 0
+        skipped = num_parts - len(pending)
+        if skipped:
+            # Resumed runs can skip hundreds of parts, so list them only in debug output
+            logger.info("Skipping %s existing parts", skipped)
+            if logger.isEnabledFor(logging.DEBUG):
+                for i in sorted(set(range(num_parts)).difference(pending)):
+                    logger.debug("Skipping existing file: %s", output_names[i])
+
+        # A single part covering the whole MP4 is the input itself. ffprobe names
+        # MOV and 3GP the same as MP4, so the ftyp brand decides; other inputs
+        # and MP4s without +faststart get the usual single -c copy export below
+        format_name = (probe or {}).get("format", {}).get("format_name", "")
+        is_mp4 = "mp4" in format_name.split(",")
+        whole = num_parts == 1 and plan[0].start == 0 and plan[0].end >= video_duration
+        if whole and is_mp4 and is_faststart_mp4(video_path):
+            output_path, success, error = export_whole_file(video_path, output_paths[0],
+                                                            plan[0].pad, has_audio)
+            if success:
+                logger.info("Exported: %s", output_path)
+                if progress_callback:
+                    progress_callback(1, 1)
+                return 1
+            logger.warning("Could not reuse %s as the only part, exporting it instead: %s", video_path, error)
+
+        # Already fragmented MP4s are cut by copying whole fragments
+        layout = read_fragment_layout(video_path) if is_mp4 else None
+        starts = [start for start, _, _ in plan[pending[0]:]]
+        increasing = all(b > a for a, b in zip(starts, starts[1:]))
+        # The segment muxer and PyAV end each part where the next one starts, so
+        # they are only used when that keeps every part within its planned end;
+        # keyframe-snapped starts can be more than segment_duration apart
+        contiguous = all(nxt.start <= part.end + 1e-6
+                         for part, nxt in zip(plan[pending[0]:], plan[pending[0] + 1:]))
+        # precise_seek exists for exact boundaries, so it always cuts part by part
+        single_pass = strategy == "segment_muxer" and increasing and contiguous
+        if layout is not None:
+            logger.info("Fragmented MP4 detected, copying %s fragments directly", len(layout.fragments))
+            completed_parts = _export_fragments(video_path, layout, plan, output_paths, pending,
+                                                progress_callback, has_audio, video_duration,
+                                                cancel_event)
+        elif single_pass and os.environ.get("PYAV") == "1":
+            completed_parts = export_with_pyav(video_path, plan, output_paths, pending,
+                                               progress_callback, has_audio, cancel_event)
+        elif len(starts) > 1 and single_pass:
+            completed_parts = _export_with_segment_muxer(video_path, plan, output_paths, pending[0],
+                                                         progress_callback, has_audio,
+                                                         video_duration, cancel_event)
+        else:
+            completed_parts = _export_individually(video_path, plan, output_paths, pending,
+                                                   progress_callback, has_audio, video_duration,
+                                                   cancel_event)
+        if _cancelled(cancel_event):
+            logger.warning("Cancelled after exporting %s parts", completed_parts)
+        return completed_parts
 
     except FileNotFoundError as e:
-        print(f"[ERROR] Video file not found: {e}")
+        logger.error("Video file not found: %s", e)
         raise
     except ValueError as e:
-        print(f"[ERROR] Invalid video data or time range: {e}")
+        logger.error("Invalid video data or time range: %s", e)
         raise
     except Exception as e:
-        print(f"[ERROR] Exception in trim_video_to_parts: {e}")
+        logger.error("Exception in trim_video_to_parts: %s", e)
         raise
 
 if __name__ == "__main__":
@@ -269,12 +1082,38 @@ if __name__ == "__main__":
         "-f", "--offset",
         type=float,
         default=0.0,
-        help="Offset applied after keyframe alignment in seconds")
+        help="Shift every cut by this many seconds; with segment_muxer ffmpeg then "
+             "cuts at the next keyframe, with precise_seek it shifts the snapped cut")
+    parser.add_argument(
+        "--preset",
+        choices=X264_PRESETS,
+        default=get_preset(),
+        help="libx264 preset used when a part has to be re-encoded (e.g. padding)")
     parser.add_argument(
         "--allow-long-last",
         action="store_true",
         help="Allow the last part to exceed the duration if it is only slightly longer")
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="Delete the cached keyframes of the video and probe it again")
+    parser.add_argument(
+        "--strategy",
+        choices=STRATEGIES,
+        default="segment_muxer",
+        help="segment_muxer lets ffmpeg find keyframes in one pass, so parts can be "
+             "up to one GOP longer than --duration; precise_seek snaps cuts to the "
+             "nearest keyframe and exports each part separately, never longer than --duration")
+    parser.add_argument(
+        "-v", "--verbose",
+        action="store_true",
+        help="Show debug messages, such as every existing part that is skipped")
     args = parser.parse_args()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    set_preset(args.preset)
+    if args.clear_cache:
+        clear_keyframe_cache(args.video)
 
     def cli_allow(length: float) -> bool:
         if args.allow_long_last:
@@ -288,7 +1127,7 @@ if __name__ == "__main__":
 
     def cli_progress(completed: int, total: int):
         percent = int(completed / total * 100)
-        print(f"\rProgress: {completed}/{total} ({percent}%)", end="")
+        print(f"\rProgress: {int(completed)}/{total} ({percent}%)", end="")
 
     trim_video_to_parts(
         args.video,
@@ -297,5 +1136,6 @@ if __name__ == "__main__":
         segment_duration=args.duration,
         offset=args.offset,
         ask_allow_long_last_part=cli_allow,
+        strategy=args.strategy,
     )
     print()
@@ -1,28 +1,112 @@
 # instavideosplitter_gui.py
 import customtkinter
 from tkinter import filedialog, messagebox
-from instavideosplitter import trim_video_to_parts
-from ffmpeg_config import set_ffmpeg_dir, get_ffmpeg_path, get_ffmpeg_dir
+from ffmpeg_config import set_ffmpeg_dir, get_ffmpeg_path, get_ffmpeg_dir, FFMPEG_QUIET_ARGS, stderr_tail, PIPE_BUFSIZE
+import io
 import os
+import time
+import tempfile
 import threading
 import subprocess
 import platform
-from PIL import Image
-from moviepy.editor import VideoFileClip
+import functools
+from collections import OrderedDict
+
+THUMBNAIL_SIZE = (200, 120)
+THUMBNAIL_CACHE_SIZE = 16
+PROGRESS_INTERVAL = 0.1  # seconds between progress redraws
+QUIT_POLL_MS = 100
+QUIT_TIMEOUT = 5  # seconds to wait for a cancelled trim before closing anyway
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
 
 customtkinter.set_appearance_mode("dark")
 customtkinter.set_default_color_theme("green")
 
+
+@functools.lru_cache(maxsize=1)
+def load_logo():
+    """Decode icon.png once per process; the file is closed right away."""
+    from PIL import Image
+    with Image.open("icon.png") as image:
+        return image.copy()
+
+
+class PreviewStream:
+    """A long-lived ffmpeg streaming scaled JPEG frames of a video, one per second.
+
+    ffmpeg blocks on the full pipe between reads, so the process idles until the
+    next frame is wanted instead of being spawned again for every preview. Only
+    the first frame (the thumbnail) is read today; the stream is kept open for a
+    future preview scrubber and is closed when a trim starts.
+    """
+
+    def __init__(self, path):
+        width, height = THUMBNAIL_SIZE
+        command = [
+            get_ffmpeg_path(), *FFMPEG_QUIET_ARGS,
+            "-i", path,
+            "-vf", f"fps=1,scale={width}:{height}",
+            "-f", "image2pipe", "-vcodec", "mjpeg", "-",
+        ]
+        self.stderr = tempfile.TemporaryFile()
+        try:
+            self.proc = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                         stderr=self.stderr, bufsize=PIPE_BUFSIZE)
+        except OSError:
+            self.stderr.close()
+            raise
+        self.buffer = bytearray()
+
+    def read_frame(self):
+        """Return the next frame as JPEG bytes.
+
+        Raises:
+            RuntimeError: If ffmpeg stopped before producing another frame.
+        """
+        while True:
+            start = self.buffer.find(JPEG_SOI)
+            end = self.buffer.find(JPEG_EOI, start + 2) if start != -1 else -1
+            if end != -1:
+                frame = bytes(self.buffer[start:end + 2])
+                del self.buffer[:end + 2]
+                return frame
+            # At most one read() syscall, of up to PIPE_BUFSIZE bytes
+            chunk = self.proc.stdout.read1()
+            if not chunk:
+                self.proc.wait()
+                self.stderr.seek(0)
+                raise RuntimeError(stderr_tail(self.stderr.read(), "ffmpeg returned no frame"))
+            self.buffer += chunk
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        self.proc.wait()
+        self.proc.stdout.close()
+        self.stderr.close()
+
 class VideoSplitterApp(customtkinter.CTk):
     def __init__(self):
         super().__init__()
         self.title("Video Trimmer for Instagram")
+        self.protocol("WM_DELETE_WINDOW", self.quit_app)
         self.geometry("900x500")
         self.file_path = None
         self.output_dir = None
         self.segment_duration = 60
         self.ffmpeg_dir = get_ffmpeg_dir()
         self.trimming_thread = None
+        self.cancel_event = threading.Event()
+        self.last_log_text = None
+        self.pending_progress = 0.0
+        self.last_progress_ts = 0.0
+        self.flush_scheduled = False
+        # Cleared on the main loop when a trim ends, so late flushes cannot overwrite the result
+        self.progress_active = False
+        self.preview = None
+        # (path, mtime, size) -> CTkImage, least recently shown first
+        self.thumb_cache = OrderedDict()
 
         self.grid_columnconfigure(0, weight=1)
         self.grid_columnconfigure(1, weight=2)
@@ -38,10 +122,10 @@ class VideoSplitterApp(customtkinter.CTk):
 
         # Logo
         try:
-            image = customtkinter.CTkImage(Image.open("icon.png"), size=(40, 40))
+            image = customtkinter.CTkImage(load_logo(), size=(40, 40))
             self.logo = customtkinter.CTkLabel(self.left_frame, image=image, text="")
             self.logo.grid(row=0, column=0, padx=10, pady=10)
-        except:
+        except OSError:
             pass
 
         # Buttons
@@ -108,7 +192,7 @@ class VideoSplitterApp(customtkinter.CTk):
         if path:
             self.file_path = path
             self.update_log()
-            self.show_thumbnail()
+            self.show_thumbnail(path)
 
     def browse_output_dir(self):
         path = filedialog.askdirectory()
@@ -119,13 +203,16 @@ class VideoSplitterApp(customtkinter.CTk):
     def browse_ffmpeg(self):
         path = filedialog.askdirectory()
         if path:
+            # Applied once here; the resolved binaries are kept by ffmpeg_config
+            try:
+                set_ffmpeg_dir(path)
+            except FileNotFoundError as e:
+                messagebox.showerror("ffmpeg not found", str(e))
+                return
             self.ffmpeg_dir = path
-            set_ffmpeg_dir(path)
             self.update_log()
 
     def update_log(self):
-        self.log_display.configure(state="normal")
-        self.log_display.delete("0.0", "end")
         log_text = (
             f"Video: {os.path.basename(self.file_path) if self.file_path else 'None'}\n"
             f"Output: {self.output_dir if self.output_dir else 'None'}\n"
@@ -133,6 +220,12 @@ class VideoSplitterApp(customtkinter.CTk):
             f"Offset: {self.offset:+.1f}s\n"
             f"ffmpeg dir: {self.ffmpeg_dir if self.ffmpeg_dir else 'Default'}"
         )
+        # Rewriting the textbox reflows it, so skip updates that change nothing
+        if log_text == self.last_log_text:
+            return
+        self.last_log_text = log_text
+        self.log_display.configure(state="normal")
+        self.log_display.delete("0.0", "end")
         self.log_display.insert("0.0", log_text)
         self.log_display.configure(state="disabled")
 
@@ -145,40 +238,76 @@ class VideoSplitterApp(customtkinter.CTk):
             self.output_dir = os.path.dirname(self.file_path)
             self.update_log()
 
-        # Ensure ffmpeg directory is applied
-        set_ffmpeg_dir(self.ffmpeg_dir)
         if self.trimming_thread and self.trimming_thread.is_alive():
             return
 
-        self.start_button.configure(state="disabled")
+        self.cancel_event = threading.Event()
+        self.start_button.configure(text="Cancel", command=self.cancel_trimming)
+        self.progress.set(0)
+        self.status_label.configure(text="Processing...")
+        self.progress_active = True
+        # The idle preview ffmpeg would hold the source open during the whole trim
+        self.stop_preview()
         self.trimming_thread = threading.Thread(target=self.run_trimming, daemon=True)
         self.trimming_thread.start()
 
+    def cancel_trimming(self):
+        self.cancel_event.set()
+        self.progress_active = False
+        self.start_button.configure(state="disabled")
+        self.status_label.configure(text="Cancelling...")
+
     def run_trimming(self):
+        # Runs on the trimming thread; widgets are only touched from finish_trimming
+        completed_parts, error = 0, None
         try:
-            self.progress.set(0)
-            self.status_label.configure(text="Processing...")
+            # Loaded on first use: the splitter pulls in numpy and the export pipeline
+            from instavideosplitter import trim_video_to_parts
             completed_parts = trim_video_to_parts(
                 self.file_path,
                 self.output_dir,
                 self.update_progress,
                 self.segment_duration,
                 offset=self.offset,
-                ask_allow_long_last_part=self.ask_allow_longer
+                ask_allow_long_last_part=self.ask_allow_longer,
+                cancel_event=self.cancel_event
             )
+        except Exception as e:
+            error = e
+        self.after(0, self.finish_trimming, completed_parts, error)
+
+    def finish_trimming(self, completed_parts, error):
+        self.progress_active = False
+        self.trimming_thread = None
+        self.start_button.configure(text="Trim Video", command=self.start_trimming, state="normal")
+        if error is not None:
+            self.status_label.configure(text="Error occurred.")
+            messagebox.showerror("Error", str(error))
+        elif self.cancel_event.is_set():
+            self.status_label.configure(text=f"Cancelled after {completed_parts} parts.")
+        else:
             self.progress.set(1)
             self.status_label.configure(text=f"Done: Trimmed into {completed_parts} parts.")
             messagebox.showinfo("Success", f"Trimmed into {completed_parts} parts.")
             self.open_output_folder()
-        except Exception as e:
-            self.status_label.configure(text="Error occurred.")
-            messagebox.showerror("Error", str(e))
-        finally:
-            self.start_button.configure(state="normal")
-            self.trimming_thread = None
 
     def update_progress(self, completed, total):
-        percent = completed / total
+        # Called from the trimming thread: hand the latest value to the main loop,
+        # with at most one flush pending and at most 10 flushes a second
+        self.pending_progress = completed / total
+        if self.flush_scheduled:
+            return
+        self.flush_scheduled = True
+        wait = max(PROGRESS_INTERVAL - (time.monotonic() - self.last_progress_ts), 0)
+        self.after(int(wait * 1000), self.flush_progress)
+
+    def flush_progress(self):
+        # Cleared before reading, so an update arriving meanwhile schedules another flush
+        self.flush_scheduled = False
+        self.last_progress_ts = time.monotonic()
+        if not self.progress_active:
+            return
+        percent = self.pending_progress
         self.progress.set(percent)
         self.status_label.configure(text=f"Progress: {int(percent * 100)}%")
 
@@ -190,26 +319,102 @@ class VideoSplitterApp(customtkinter.CTk):
         else:
             subprocess.run(["xdg-open", self.output_dir])
 
-    def show_thumbnail(self):
+    def read_thumbnail(self, preview):
+        """Decode the next frame of a preview stream into a PIL image."""
+        from PIL import Image
+        image = Image.open(io.BytesIO(preview.read_frame()))
+        image.load()
+        return image
+
+    def stop_preview(self):
+        if self.preview is not None:
+            self.preview.close()
+            self.preview = None
+
+    def show_thumbnail(self, path):
+        self.stop_preview()
         try:
-            clip = VideoFileClip(self.file_path)
-            frame = clip.get_frame(0)
-            pil_img = Image.fromarray(frame)
-            thumb_image = customtkinter.CTkImage(pil_img, size=(200, 120))
+            stat = os.stat(path)
+        except OSError as e:
+            self.thumbnail_label.configure(text=f"Thumbnail error: {str(e)}")
+            return
+        key = (path, stat.st_mtime, stat.st_size)
+        thumb_image = self.thumb_cache.get(key)
+        if thumb_image is not None:
+            self.thumb_cache.move_to_end(key)
             self.thumbnail_label.configure(image=thumb_image, text="")
             self.thumbnail_label.image = thumb_image
-            pil_img.close()
-            clip.close()
-        except Exception as e:
+            return
+        try:
+            self.preview = PreviewStream(path)
+        except OSError as e:
             self.thumbnail_label.configure(text=f"Thumbnail error: {str(e)}")
+            return
+        self.thumbnail_label.configure(text="Loading thumbnail...")
+        threading.Thread(target=self.thumbnail_worker, args=(key, self.preview), daemon=True).start()
+
+    def thumbnail_worker(self, key, preview):
+        # Runs off the main loop; Tk widgets are only touched from apply_thumbnail
+        try:
+            pil_img = self.read_thumbnail(preview)
+        except Exception as e:
+            self.after(0, lambda err=str(e): self.apply_thumbnail(key, None, err, preview))
+        else:
+            self.after(0, lambda: self.apply_thumbnail(key, pil_img))
+
+    def apply_thumbnail(self, key, pil_img, error=None, preview=None):
+        if pil_img is not None:
+            self.thumb_cache[key] = customtkinter.CTkImage(pil_img, size=THUMBNAIL_SIZE)
+            if len(self.thumb_cache) > THUMBNAIL_CACHE_SIZE:
+                self.thumb_cache.popitem(last=False)
+        if key[0] != self.file_path:
+            # Another video was selected while this one was decoding
+            return
+        if pil_img is None:
+            if preview is not None and preview is not self.preview:
+                # The stream was stopped on purpose, e.g. by starting a trim
+                self.thumbnail_label.configure(text="Thumbnail preview stopped")
+            else:
+                self.thumbnail_label.configure(text=f"Thumbnail error: {error}")
+            return
+        thumb_image = self.thumb_cache[key]
+        self.thumbnail_label.configure(image=thumb_image, text="")
+        self.thumbnail_label.image = thumb_image
 
     def ask_allow_longer(self, length):
-        return messagebox.askyesno(
-            "Allow longer last part?",
-            f"The last part will be {length:.1f}s. Allow this length?"
-        )
+        # Called from the trimming thread: show the dialog on the main loop and wait for it
+        answer = []
+        answered = threading.Event()
+
+        def ask():
+            try:
+                answer.append(messagebox.askyesno(
+                    "Allow longer last part?",
+                    f"The last part will be {length:.1f}s. Allow this length?"
+                ))
+            finally:
+                answered.set()
+
+        self.after(0, ask)
+        answered.wait()
+        return bool(answer and answer[0])
 
     def quit_app(self):
+        self.stop_preview()
+        if self.trimming_thread and self.trimming_thread.is_alive():
+            # Let the export kill its ffmpeg processes first. Poll instead of joining
+            # so the main loop keeps serving the worker's after() calls meanwhile.
+            self.cancel_trimming()
+            self.quit_button.configure(state="disabled")
+            self.wait_for_trim_then_quit(time.monotonic() + QUIT_TIMEOUT)
+            return
+        self.destroy()
+
+    def wait_for_trim_then_quit(self, deadline):
+        thread = self.trimming_thread
+        if thread and thread.is_alive() and time.monotonic() < deadline:
+            self.after(QUIT_POLL_MS, self.wait_for_trim_then_quit, deadline)
+            return
         self.destroy()
 
     def toggle_theme(self):
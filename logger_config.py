@@ -0,0 +1,48 @@
+# logger_config.py
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Same look as the "[LEVEL] message" lines the tools have always printed
+LOG_FORMAT = "[%(levelname)s] %(message)s"
+
+_listener = None
+_configured = False
+
+
+def _configure() -> None:
+    """Route log records through a queue drained by a single listener thread.
+
+    Worker threads only enqueue records, so they never contend on the stream
+    handler's lock while ffmpeg/ffprobe calls run in parallel.
+    """
+    global _listener
+    # LOG_FORMAT has no time, thread or process fields, so skip filling them in
+    # on every record
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging.logAsyncioTasks = False
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Get a logger, setting up queued logging on first use."""
+    global _configured
+    if not _configured:
+        # Leave logging alone if the embedding application configured it already
+        if not logging.getLogger().hasHandlers():
+            _configure()
+        _configured = True
+    return logging.getLogger(name)
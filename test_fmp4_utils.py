@@ -0,0 +1,174 @@
+# test_fmp4_utils.py
+import os
+import struct
+import tempfile
+import unittest
+
+from fmp4_utils import (_find_box, _iter_boxes, _payload, is_faststart_mp4, read_fragment_layout,
+                        write_fragments)
+
+MOVIE_TIMESCALE = 1000
+VIDEO_TIMESCALE = 90000
+AUDIO_TIMESCALE = 48000
+FRAGMENT_SECONDS = 2
+FRAGMENTS = 5
+# tfhd flag: sample data offsets are relative to the moof
+DEFAULT_BASE_IS_MOOF = 0x020000
+
+
+def box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def full_box(kind: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return box(kind, struct.pack(">I", (version << 24) | flags) + payload)
+
+
+def trak(track_id: int, timescale: int, handler: bytes) -> bytes:
+    duration = FRAGMENTS * FRAGMENT_SECONDS
+    tkhd = full_box(b"tkhd", 0, 3, struct.pack(">IIIII", 0, 0, track_id, 0,
+                                               duration * MOVIE_TIMESCALE) + bytes(60))
+    # One empty edit delaying the track, then the edit playing the media
+    elst = full_box(b"elst", 1, 0, struct.pack(">I", 2)
+                    + struct.pack(">Qqi", 10, -1, 0x10000)
+                    + struct.pack(">Qqi", duration * MOVIE_TIMESCALE, 0, 0x10000))
+    mdhd = full_box(b"mdhd", 1, 0, struct.pack(">QQIQ", 0, 0, timescale, duration * timescale)
+                    + bytes(4))
+    hdlr = full_box(b"hdlr", 0, 0, bytes(4) + handler + bytes(12) + b"\0")
+    return box(b"trak", tkhd + box(b"edts", elst) + box(b"mdia", mdhd + hdlr))
+
+
+def moof(sequence: int, track_id: int, version: int, decode_time: int) -> bytes:
+    tfdt = full_box(b"tfdt", version, 0,
+                    struct.pack(">Q" if version == 1 else ">I", decode_time))
+    traf = box(b"traf", full_box(b"tfhd", 0, DEFAULT_BASE_IS_MOOF, struct.pack(">I", track_id))
+               + tfdt + full_box(b"trun", 0, 0, struct.pack(">I", 0)))
+    return box(b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", sequence)) + traf)
+
+
+def build_fmp4() -> bytes:
+    """A fragmented MP4 with a video fragment and an audio fragment every two seconds."""
+    duration = FRAGMENTS * FRAGMENT_SECONDS * MOVIE_TIMESCALE
+    mvhd = full_box(b"mvhd", 0, 0, struct.pack(">IIII", 0, 0, MOVIE_TIMESCALE, duration) + bytes(80))
+    mvex = box(b"mvex", full_box(b"mehd", 0, 0, struct.pack(">I", duration))
+               + full_box(b"trex", 0, 0, struct.pack(">IIIII", 1, 1, 0, 0, 0))
+               + full_box(b"trex", 0, 0, struct.pack(">IIIII", 2, 1, 0, 0, 0)))
+    data = box(b"ftyp", b"isom" + struct.pack(">I", 512) + b"isomiso6")
+    data += box(b"moov", mvhd + mvex + trak(1, VIDEO_TIMESCALE, b"vide")
+                + trak(2, AUDIO_TIMESCALE, b"soun"))
+    for i in range(FRAGMENTS):
+        seconds = i * FRAGMENT_SECONDS
+        data += moof(2 * i + 1, 1, 1, seconds * VIDEO_TIMESCALE) + box(b"mdat", b"video%d" % i * 50)
+        data += moof(2 * i + 2, 2, 0, seconds * AUDIO_TIMESCALE) + box(b"mdat", b"audio%d" % i * 20)
+    return data
+
+
+def top_level(data: bytes, kind: bytes):
+    return [data[start - 8:end] for box_kind, start, end in _iter_boxes(data) if box_kind == kind]
+
+
+def child(data: bytes, path):
+    """Payload bounds of the first box at ``path`` below a top-level box."""
+    start, end = _payload(data)
+    for kind in path:
+        start, end = _find_box(data, start, end, kind)
+    return start, end
+
+
+def decode_times(data: bytes):
+    times = []
+    for moof_box in top_level(data, b"moof"):
+        tfdt = child(moof_box, [b"traf", b"tfdt"])[0]
+        fmt = ">Q" if moof_box[tfdt] == 1 else ">I"
+        times.append(struct.unpack_from(fmt, moof_box, tfdt + 4)[0])
+    return times
+
+
+class WriteFragmentsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "source.mp4")
+        with open(self.source, "wb") as f:
+            f.write(build_fmp4())
+        self.layout = read_fragment_layout(self.source)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_part(self, start, end):
+        output = os.path.join(self.tmp.name, "part.mp4")
+        _, success, error = write_fragments(self.source, self.layout, start, end, output,
+                                            FRAGMENTS * FRAGMENT_SECONDS)
+        self.assertTrue(success, error)
+        with open(output, "rb") as f:
+            return output, f.read()
+
+    def test_layout(self):
+        self.assertEqual([frag.time for frag in self.layout.fragments], [0, 2, 4, 6, 8])
+        self.assertEqual(self.layout.timescales, {1: VIDEO_TIMESCALE, 2: AUDIO_TIMESCALE})
+
+    def test_middle_part_starts_at_zero(self):
+        output, data = self.write_part(4, 8)
+        self.assertEqual(decode_times(data), [0, 0, 2 * VIDEO_TIMESCALE, 2 * AUDIO_TIMESCALE])
+        # The part is itself a valid fragmented MP4 starting at zero
+        self.assertEqual([frag.time for frag in read_fragment_layout(output).fragments], [0, 2])
+
+    def test_header_durations_describe_the_part(self):
+        _, data = self.write_part(4, 8)
+        moov = top_level(data, b"moov")[0]
+        mvhd = child(moov, [b"mvhd"])[0]
+        self.assertEqual(struct.unpack_from(">I", moov, mvhd + 16)[0], 4 * MOVIE_TIMESCALE)
+        mehd = child(moov, [b"mvex", b"mehd"])[0]
+        self.assertEqual(struct.unpack_from(">I", moov, mehd + 4)[0], 4 * MOVIE_TIMESCALE)
+        for trak_start, trak_end in [(start, end) for kind, start, end
+                                     in _iter_boxes(moov, *_payload(moov)) if kind == b"trak"]:
+            tkhd = _find_box(moov, trak_start, trak_end, b"tkhd")[0]
+            self.assertEqual(struct.unpack_from(">I", moov, tkhd + 20)[0], 4 * MOVIE_TIMESCALE)
+            mdia = _find_box(moov, trak_start, trak_end, b"mdia")
+            mdhd = _find_box(moov, mdia[0], mdia[1], b"mdhd")[0]
+            timescale, duration = struct.unpack_from(">IQ", moov, mdhd + 20)
+            self.assertEqual(duration, 4 * timescale)
+            edts = _find_box(moov, trak_start, trak_end, b"edts")
+            elst = _find_box(moov, edts[0], edts[1], b"elst")[0]
+            empty, _, _, media, _, _ = struct.unpack_from(">QqiQqi", moov, elst + 8)
+            self.assertEqual((empty, media), (10, 4 * MOVIE_TIMESCALE - 10))
+
+    def test_last_part_uses_source_duration(self):
+        _, data = self.write_part(8, float("inf"))
+        moov = top_level(data, b"moov")[0]
+        mehd = child(moov, [b"mvex", b"mehd"])[0]
+        self.assertEqual(struct.unpack_from(">I", moov, mehd + 4)[0], 2 * MOVIE_TIMESCALE)
+        self.assertEqual(decode_times(data), [0, 0])
+
+    def test_sample_data_is_copied_unchanged(self):
+        _, data = self.write_part(2, 6)
+        source_mdats = top_level(build_fmp4(), b"mdat")
+        self.assertEqual(top_level(data, b"mdat"), source_mdats[2:6])
+
+
+class FaststartTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check(self, data: bytes) -> bool:
+        path = os.path.join(self.tmp.name, "input.mp4")
+        with open(path, "wb") as f:
+            f.write(data)
+        return is_faststart_mp4(path)
+
+    def test_mp4_with_moov_first(self):
+        self.assertTrue(self.check(build_fmp4()))
+
+    def test_moov_after_mdat(self):
+        ftyp = box(b"ftyp", b"isom" + bytes(4))
+        self.assertFalse(self.check(ftyp + box(b"mdat", bytes(16)) + box(b"moov", bytes(8))))
+
+    def test_quicktime_brand(self):
+        self.assertFalse(self.check(box(b"ftyp", b"qt  " + bytes(4)) + box(b"moov", bytes(8))))
+
+
+if __name__ == "__main__":
+    unittest.main()